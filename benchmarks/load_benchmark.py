@@ -0,0 +1,259 @@
+"""End-to-end load test: an alarm storm against a local server.
+
+Starts `uvicorn main:app` in a scratch copy of the app with a fresh
+log.sqlite and points TELEGRAM_API_BASE at a fake Telegram server run by
+this script, so no real messages are sent. Three scenarios then run at the
+same time for --duration seconds:
+
+    ch_lookup   GET /calculate_ch_for_section with random sections and ODs
+    send_alert  POST /send_alert, queued through the outbox
+    webhook     POST /webhook in bursts of --burst updates
+
+Each scenario reports throughput and p50/p99 latency, alongside the
+webhook writer counters and the number of messages the fake Telegram
+server received. That last number stays small because the outbox paces a
+chat to one message per second, however fast alerts are queued.
+
+    python benchmarks/load_benchmark.py --duration 10 --output load.json
+"""
+import argparse
+import csv
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from startup_benchmark import copy_app, free_port
+
+BENCH_SETTINGS = {"BOT_TOKEN": "bench", "CHAT_ID": "1000"}
+
+
+class FakeTelegram(BaseHTTPRequestHandler):
+    """Answers every Bot API call with ok=true after `latency` seconds."""
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    lock = threading.Lock()
+    messages = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latency)
+        with FakeTelegram.lock:
+            FakeTelegram.messages += 1
+            message_id = FakeTelegram.messages
+        body = json.dumps({"ok": True, "result": {"message_id": message_id}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(latencies, errors, elapsed):
+    if not latencies:
+        return {"requests": 0, "errors": errors}
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3),
+    }
+
+
+def read_od_ranges(workdir):
+    with open(os.path.join(workdir, "OD_CH Master.csv"), newline="", encoding="utf-8-sig") as f:
+        ods = {}
+        for row in csv.DictReader(f):
+            try:
+                ods.setdefault(row["Section"], []).append(float(row["OD"]))
+            except (TypeError, ValueError):
+                continue
+    return {section: (min(values), max(values)) for section, values in ods.items()}
+
+
+class Scenario:
+    def __init__(self, name, port, make_request, pause=0.0, burst=1):
+        self.name = name
+        self.port = port
+        self.make_request = make_request
+        self.pause = pause
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+
+    def worker(self, deadline, seed):
+        rng = random.Random(seed)
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        latencies, errors = [], 0
+        while time.perf_counter() < deadline:
+            for _ in range(self.burst):
+                method, path, body = self.make_request(rng)
+                headers = {"Content-Type": "application/json"} if body is not None else {}
+                started = time.perf_counter()
+                try:
+                    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+                    res = conn.getresponse()
+                    res.read()
+                    ok = res.status == 200
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                errors += not ok
+            if self.pause:
+                time.sleep(self.pause)
+        conn.close()
+        with self.lock:
+            self.latencies += latencies
+            self.errors += errors
+
+
+def get_json(port, path):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        conn.request("GET", path)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def wait_until_up(port, timeout):
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            get_json(port, "/ping")
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"No response from /ping within {timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds each scenario runs")
+    parser.add_argument("--lookup-clients", type=int, default=8)
+    parser.add_argument("--alert-clients", type=int, default=4)
+    parser.add_argument("--webhook-clients", type=int, default=4)
+    parser.add_argument("--burst", type=int, default=50, help="webhook updates per burst")
+    parser.add_argument("--burst-pause", type=float, default=0.2, help="seconds between webhook bursts")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="fake Telegram response time in seconds")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    FakeTelegram.latency = args.telegram_latency
+    telegram = ThreadingHTTPServer(("127.0.0.1", 0), FakeTelegram)
+    threading.Thread(target=telegram.serve_forever, daemon=True).start()
+
+    workdir = tempfile.mkdtemp(prefix="pids_load_")
+    port = free_port()
+    proc = None
+    try:
+        copy_app(workdir)
+        with open(os.path.join(workdir, "settings.json"), "w") as f:
+            json.dump(BENCH_SETTINGS, f)
+        od_ranges = read_od_ranges(workdir)
+        sections = list(od_ranges)
+
+        env = {**os.environ, "TELEGRAM_API_BASE": f"http://127.0.0.1:{telegram.server_address[1]}"}
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            cwd=workdir,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        wait_until_up(port, args.timeout)
+
+        def ch_lookup(rng):
+            section = rng.choice(sections)
+            od = round(rng.uniform(*od_ranges[section]))
+            return "GET", f"/calculate_ch_for_section?section={section.replace(' ', '%20')}&od={od}", None
+
+        def send_alert(rng):
+            section = rng.choice(sections)
+            alarm = {
+                "od": round(rng.uniform(*od_ranges[section])),
+                "ch": round(rng.uniform(285, 450), 3),
+                "section": section,
+                "line_walker": "bench",
+            }
+            return "POST", "/send_alert", alarm
+
+        update_ids = iter(range(1, 1 << 62))
+        update_lock = threading.Lock()
+
+        def webhook(rng):
+            with update_lock:
+                update_id = next(update_ids)
+            text = rng.choice(["duty on", "duty off", "ok", "reached CH 301"])
+            return "POST", "/webhook", {"update_id": update_id, "message": {"text": text, "from": {"first_name": "bench"}}}
+
+        scenarios = [
+            (Scenario("ch_lookup", port, ch_lookup), args.lookup_clients),
+            (Scenario("send_alert", port, send_alert), args.alert_clients),
+            (Scenario("webhook", port, webhook, args.burst_pause, args.burst), args.webhook_clients),
+        ]
+
+        total_workers = sum(count for _scenario, count in scenarios)
+        started = time.perf_counter()
+        deadline = started + args.duration
+        with ThreadPoolExecutor(max_workers=total_workers) as pool:
+            seed = 0
+            for scenario, count in scenarios:
+                for _ in range(count):
+                    seed += 1
+                    pool.submit(scenario.worker, deadline, seed)
+        elapsed = time.perf_counter() - started
+
+        result = {
+            "benchmark": "load",
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "duration_s": round(elapsed, 3),
+            "config": {k: v for k, v in vars(args).items() if k != "output"},
+            "scenarios": {
+                scenario.name: {"clients": count, **summarize(scenario.latencies, scenario.errors, elapsed)}
+                for scenario, count in scenarios
+            },
+            "webhook_writer": get_json(port, "/webhook_stats"),
+            "telegram_messages_received": FakeTelegram.messages,
+        }
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+        telegram.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Micro-benchmarks for the lookup helpers on the real OD_CH tables.
+
+Times interpolate_ch, interpolate_od and get_linewalker_by_ch one call at
+a time on random inputs drawn from each section's own OD and CH range,
+and reports calls per second with p50/p99 per-call latency. The app runs
+from a scratch copy, so the repository's files are never touched.
+
+    python benchmarks/micro_benchmark.py --calls 20000 --output micro.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from startup_benchmark import copy_app
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(durations_ns):
+    total_s = sum(durations_ns) / 1e9
+    return {
+        "calls": len(durations_ns),
+        "calls_per_s": round(len(durations_ns) / total_s) if total_s else None,
+        "mean_us": round(statistics.fmean(durations_ns) / 1000, 3),
+        "p50_us": round(percentile(durations_ns, 50) / 1000, 3),
+        "p99_us": round(percentile(durations_ns, 99) / 1000, 3),
+        "max_us": round(max(durations_ns) / 1000, 3),
+    }
+
+
+def time_calls(func, args_list):
+    durations = []
+    clock = time.perf_counter_ns
+    for args in args_list:
+        started = clock()
+        func(*args)
+        durations.append(clock() - started)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20000, help="calls per benchmark")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    workdir = tempfile.mkdtemp(prefix="pids_micro_")
+    try:
+        copy_app(workdir)
+        os.chdir(workdir)
+        sys.path.insert(0, workdir)
+        result = run(args)
+    finally:
+        os.chdir("/")
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(result, indent=2))
+    if output:
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+def run(args):
+    import main as app
+
+    app.init_db()  # section tables are published through the shared_state table
+    app.load_section_tables()
+    app.refresh_linewalkers()
+    app.sync_shared_state()  # refresh_linewalkers only seeds the store; this builds the index
+    if not app.linewalker_data:
+        raise RuntimeError("no line walker ranges loaded; get_linewalker_by_ch would time an empty index")
+    rng = random.Random(args.seed)
+
+    sections = list(app.section_data)
+    od_calls, ch_calls = [], []
+    for _ in range(args.calls):
+        section = rng.choice(sections)
+        table = app.section_data[section]
+        od_calls.append((app.section_engines[section], rng.uniform(min(table["OD"]), max(table["OD"]))))
+        ch_calls.append((table, rng.uniform(min(table["CH"]), max(table["CH"]))))
+    walker_calls = [(ch,) for _table, ch in ch_calls]
+
+    benchmarks = {
+        "interpolate_ch": summarize(time_calls(app.interpolate_ch, od_calls)),
+        "interpolate_od": summarize(time_calls(app.interpolate_od, ch_calls)),
+        "get_linewalker_by_ch": summarize(time_calls(app.get_linewalker_by_ch, walker_calls)),
+    }
+
+    return {
+        "benchmark": "micro",
+        "started_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "seed": args.seed,
+        "sections": {s: len(app.section_data[s]["OD"]) for s in sections},
+        "linewalker_ranges": len(app.linewalker_data),
+        "results": benchmarks,
+    }
+
+
+if __name__ == "__main__":
+    main()
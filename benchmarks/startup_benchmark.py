@@ -0,0 +1,114 @@
+"""Cold-start benchmark: process start to first successful response.
+
+Starts `uvicorn main:app` in a scratch copy of the app (so it gets a fresh
+log.sqlite), polls /ping until it answers and records how long that took.
+It also times a bare `import main`. The run fails (exit code 1) when the
+median of either number goes over its budget.
+
+    python benchmarks/startup_benchmark.py --runs 5 --budget 2.0
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILES = ["main.py", "charts.py", "settings.json", "linewalkers.json"]
+
+
+def copy_app(dest):
+    for name in os.listdir(ROOT):
+        if name in APP_FILES or (name.startswith("OD_CH") and name.endswith(".csv")):
+            shutil.copy(os.path.join(ROOT, name), dest)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_import(workdir):
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=workdir, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def time_first_response(workdir, timeout):
+    port = free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=workdir,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/ping", timeout=1) as res:
+                    if res.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f"No response from /ping within {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=2.0, help="max median seconds to first response")
+    parser.add_argument("--import-budget", type=float, default=0.6, help="max median seconds for `import main`")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    imports, responses = [], []
+    for _ in range(args.runs):
+        workdir = tempfile.mkdtemp(prefix="pids_startup_")
+        try:
+            copy_app(workdir)
+            imports.append(time_import(workdir))
+            shutil.rmtree(workdir)
+            os.mkdir(workdir)
+            copy_app(workdir)
+            responses.append(time_first_response(workdir, args.timeout))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "runs": args.runs,
+        "import_median_s": round(statistics.median(imports), 4),
+        "import_max_s": round(max(imports), 4),
+        "first_response_median_s": round(statistics.median(responses), 4),
+        "first_response_max_s": round(max(responses), 4),
+        "import_budget_s": args.import_budget,
+        "first_response_budget_s": args.budget,
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    failed = False
+    if result["import_median_s"] > args.import_budget:
+        print(f"FAIL: import main took {result['import_median_s']}s (budget {args.import_budget}s)")
+        failed = True
+    if result["first_response_median_s"] > args.budget:
+        print(f"FAIL: first response took {result['first_response_median_s']}s (budget {args.budget}s)")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
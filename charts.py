@@ -0,0 +1,81 @@
+"""Chart rendering for the analytics endpoints.
+
+These functions run inside the chart worker processes started by main.py.
+They take plain Python data, draw on a standalone Figure with the Agg
+canvas and return PNG bytes, so no pyplot global state is ever touched.
+matplotlib is imported inside the functions so that main.py can import
+this module without paying for it.
+"""
+import io
+
+
+def figure_png(fig):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    FigureCanvasAgg(fig)
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+def render_scatter(series):
+    """series: list of (section, [datetime, ...], [ch, ...])"""
+    import matplotlib.dates as mdates
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(11, 6))
+    ax = fig.add_subplot()
+    for section, times, chs in series:
+        ax.scatter(times, chs, label=section, s=40, alpha=0.8)
+
+    ax.set_title("📊 Chainage vs Time (Section-wise, Last 24 Hours)", fontsize=14)
+    ax.set_xlabel("Time", fontsize=12)
+    ax.set_ylabel("Chainage", fontsize=12)
+    ax.legend(title="Section", loc="best")
+    ax.grid(True)
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
+    fig.autofmt_xdate()
+    return figure_png(fig)
+
+
+def render_grouping(by, labels, values):
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 6))
+    ax = fig.add_subplot()
+    labels = [str(label) for label in labels]
+    ax.bar(labels, values, color='teal')
+    ax.set_title(f"Alarm Count by {by.capitalize()} (Last 24 Hours)", fontsize=14)
+    ax.set_ylabel("Count")
+    ax.set_xlabel(by.capitalize())
+    ax.set_xticks(range(len(labels)))
+    ax.set_xticklabels(labels, rotation=45, ha='right')
+    ax.grid(axis="y")
+
+    fig.tight_layout()
+    return figure_png(fig)
+
+
+def render_heatmap(title, bin_labels, hour_counts):
+    """hour_counts: one list of 24 hourly counts per CH bin, in bin_labels order."""
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(11, min(16, max(4, 0.3 * len(bin_labels) + 2))))
+    ax = fig.add_subplot()
+    if not bin_labels:
+        ax.set_title(title, fontsize=14)
+        ax.text(0.5, 0.5, "No alarms in this period", ha="center", va="center", transform=ax.transAxes)
+        ax.set_axis_off()
+        return figure_png(fig)
+    image = ax.imshow(hour_counts, aspect="auto", cmap="YlOrRd", interpolation="nearest", origin="lower")
+    fig.colorbar(image, ax=ax, label="Alarms")
+    ax.set_title(title, fontsize=14)
+    ax.set_xlabel("Hour of day")
+    ax.set_ylabel("Chainage (km)")
+    ax.set_xticks(range(24))
+    step = max(1, len(bin_labels) // 30)
+    ax.set_yticks(range(0, len(bin_labels), step))
+    ax.set_yticklabels(bin_labels[::step])
+
+    fig.tight_layout()
+    return figure_png(fig)
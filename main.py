@@ -1,34 +1,96 @@
-from fastapi import FastAPI, Request, Header, Depends, HTTPException, BackgroundTasks
+from fastapi import FastAPI, Request, Header, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
+from fastapi.routing import APIRoute
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse, Response
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from collections import Counter
+from collections import Counter, OrderedDict, deque
 from datetime import datetime, timedelta
 import sqlite3
-import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-import requests
+import numpy as np
 import json
+import hashlib
+import gzip
+import bisect
 import os
 import io
+import re
+import sys
+import tempfile
 import threading
+import asyncio
+import contextvars
+import functools
+import inspect
+import heapq
+import itertools
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+import queue
 import time
+import random
 from fastapi import Body
 import subprocess
 import platform
-import openpyxl
+import charts
 from fastapi import Depends
 import csv
 from io import BytesIO
 from fastapi import APIRouter
-from typing import List
+from typing import List, Optional
+from contextlib import contextmanager, asynccontextmanager
 from datetime import datetime, timedelta
 
 LINEWALKER_FILE = "linewalkers.json"
 RESET_DURATION_HOURS = 9
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    startup()
+    scheduler.start()
+    live_feed.start()
+    yield
+    await live_feed.stop()
+    await scheduler.stop()
+    await asyncio.to_thread(outbox_dispatcher.stop)
+    await asyncio.to_thread(update_poller.stop)
+    release_leases()  # another worker takes over now, not when the lease expires
+
+# Every endpoint is wrapped so the request profiler (see Request Profiling)
+# can tell which thread, and which frame on it, is serving which request.
+profiled_request = contextvars.ContextVar("profiled_request", default=None)
+
+def profiled_endpoint(endpoint):
+    def mark(record):
+        record["thread"] = threading.get_ident()
+        record["frame"] = sys._getframe(1)
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            record = profiled_request.get()
+            if record is not None:
+                mark(record)
+            return await endpoint(*args, **kwargs)
+    else:
+        # Sync endpoints run in the threadpool, which copies the request's context
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            record = profiled_request.get()
+            if record is not None:
+                mark(record)
+            return endpoint(*args, **kwargs)
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, profiled_endpoint(endpoint), **kwargs)
+
+
+app = FastAPI(lifespan=lifespan)
+app.router.route_class = ProfiledRoute
 sent_count = 0
 
 API_KEY = "Yj@mb51"
@@ -49,18 +111,185 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ========== Metrics ==========
+# Counters and histograms kept in plain dicts behind one lock each and
+# rendered in the Prometheus text format by GET /metrics. Recording is a
+# bisect and two additions, cheap enough to leave on in production. Values
+# that are already tracked elsewhere (queue depth, database size) are read
+# when /metrics is scraped instead of being recorded on every change.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def metric_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class MetricCounter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self.lock = threading.Lock()
+        self.values = {} if labels else {(): 0}  # an unlabelled counter is exported from zero
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = sorted(self.values.items())
+        lines += [f"{self.name}{metric_labels(self.labels, key)} {value}" for key, value in items]
+        return lines
+
+
+class MetricHistogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self.lock = threading.Lock()
+        self.values = {}  # labels -> [count per bucket..., +Inf count, sum]
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((key, list(series)) for key, series in self.values.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{metric_labels(self.labels, key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{metric_labels(self.labels, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{metric_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class MetricGauge:
+    """Gauge whose samples come from calling `read` at scrape time."""
+
+    def __init__(self, name, help, read, labels=()):
+        self.name, self.help, self.read, self.labels = name, help, read, labels
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            samples = self.read()
+        except Exception as e:
+            print(f"[Metrics] Could not read {self.name}: {e}")
+            return lines
+        if not isinstance(samples, dict):
+            samples = {(): samples}
+        lines += [f"{self.name}{metric_labels(self.labels, key)} {value}" for key, value in samples.items()]
+        return lines
+
+
+HTTP_REQUEST_SECONDS = MetricHistogram("pids_http_request_seconds", "Time spent serving HTTP requests.", ("method", "route"))
+HTTP_REQUESTS = MetricCounter("pids_http_requests_total", "HTTP requests by response status.", ("method", "route", "status"))
+TELEGRAM_REQUEST_SECONDS = MetricHistogram("pids_telegram_request_seconds", "Telegram Bot API call latency.", ("method",))
+TELEGRAM_ERRORS = MetricCounter("pids_telegram_errors_total", "Failed Telegram Bot API calls.", ("method", "reason"))
+SQLITE_TRANSACTION_SECONDS = MetricHistogram(
+    "pids_sqlite_transaction_seconds",
+    "Write transaction time, split into running the statements and the commit.",
+    ("phase",)
+)
+CHART_RENDER_SECONDS = MetricHistogram("pids_chart_render_seconds", "Chart rendering time in the worker pool.", ("chart",))
+WEBHOOK_ROWS_COMMITTED = MetricCounter("pids_webhook_rows_committed_total", "Webhook rows committed since startup.")
+
+
+class MetricsMiddleware:
+    """Times every HTTP request under its route template, e.g. /logs/{table}."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router records the matched route in the shared scope
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, scope["method"], path)
+            HTTP_REQUESTS.inc(scope["method"], path, str(status))
+
+
+app.add_middleware(MetricsMiddleware)
+
+def database_size():
+    return {(path,): os.path.getsize(path) for path in (DB_FILE, DB_FILE + "-wal") if os.path.exists(path)}
+
+def outbox_counts():
+    rows = get_db().execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+    return {(status,): count for status, count in rows}
+
+METRICS = [
+    HTTP_REQUEST_SECONDS,
+    HTTP_REQUESTS,
+    TELEGRAM_REQUEST_SECONDS,
+    TELEGRAM_ERRORS,
+    SQLITE_TRANSACTION_SECONDS,
+    CHART_RENDER_SECONDS,
+    WEBHOOK_ROWS_COMMITTED,
+    MetricGauge("pids_webhook_queue_depth", "Webhook rows waiting for the background writer.", lambda: webhook_writer.queue.qsize()),
+    MetricGauge("pids_outbox_alerts", "Alerts in the outbox by status.", outbox_counts, ("status",)),
+    MetricGauge("pids_database_size_bytes", "Size of the SQLite database and its WAL.", database_size, ("file",)),
+    MetricGauge("pids_live_clients", "Connected /live stream clients.", lambda: len(live_feed.subscribers)),
+]
+
+@app.get("/metrics")
+def metrics():
+    lines = [line for metric in METRICS for line in metric.render()]
+    return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
 def verify_api_key(x_api_key: str = Header(...)):
     if x_api_key != API_KEY:
         raise HTTPException(status_code=403, detail="Unauthorized")
 
 def load_settings():
+    # Reads settings.json, which seeds the shared store on first start
     global settings
     if os.path.exists(SETTINGS_FILE):
         with open(SETTINGS_FILE) as f:
             settings = json.load(f)
     else:
         settings = {"BOT_TOKEN": "", "CHAT_ID": ""}
-load_settings()
+
+def apply_settings(value):
+    global settings
+    settings = value
+
+def write_settings_file(config):
+    with open(SETTINGS_FILE, "w") as f:
+        json.dump(config, f, indent=2)
+
+def save_settings(config):
+    """Publish new settings to every worker and mirror them to settings.json."""
+    write_settings_file(config)
+    publish_state("settings", config)
 
 
 class TokenData(BaseModel):
@@ -70,31 +299,683 @@ class TokenData(BaseModel):
 @app.post("/update_token")
 def update_token(data: TokenData, auth=Depends(verify_api_key)):
     try:
-        config = {"BOT_TOKEN": data.token, "CHAT_ID": data.chat_id}
-        with open(SETTINGS_FILE, "w") as f:
-            json.dump(config, f, indent=2)
-        global settings
-        settings = load_settings()
+        config = {**settings, "BOT_TOKEN": data.token, "CHAT_ID": data.chat_id}
+        save_settings(config)
         return {"status": "success", "message": "Token updated"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"status": "error", "detail": str(e)})
 
 
-def log_message_sqlite(data):
-    now = datetime.now()
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''INSERT INTO sent_logs (date, time, od, ch, section, linewalker)
-                 VALUES (?, ?, ?, ?, ?, ?)''', (
+# ========== Request Profiling ==========
+# Opt-in wall-clock sampling profiler. While it is enabled, a sampler thread
+# reads every thread's stack each interval_ms. Each in-flight request records
+# the thread running its endpoint and the endpoint's calling frame, so a stack
+# is credited only to the request whose endpoint it is inside, even when
+# several requests to the same route run at once.
+# Requests whose path or route matches `routes`, or that take longer than
+# `slow_ms`, keep their samples as collapsed stacks (the flamegraph.pl input
+# format) in a ring of the last `keep` profiles; other requests are dropped.
+# Settings live under "PROFILING" in settings.json and apply immediately.
+PROFILING_DEFAULTS = {"enabled": False, "routes": "", "slow_ms": 1000.0, "interval_ms": 5.0, "keep": 20}
+
+def profiling_config():
+    return {**PROFILING_DEFAULTS, **settings.get("PROFILING", {})}
+
+def frame_label(code):
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class RequestProfiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = []  # records of requests still in flight
+        self.busy = threading.Event()
+        self.profiles = deque(maxlen=PROFILING_DEFAULTS["keep"])
+        self.next_id = 1
+        self.thread = None
+
+    def begin(self, scope):
+        record = {
+            "scope": scope,
+            "thread": None,  # set by profiled_endpoint once the endpoint is running
+            "frame": None,
+            "method": scope["method"],
+            "path": scope["path"],
+            "started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "started": time.perf_counter(),
+            "samples": 0,
+            "stacks": Counter()
+        }
+        with self.lock:
+            self.active.append(record)
+            self.busy.set()
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="request-profiler", daemon=True)
+                self.thread.start()
+        return record
+
+    def end(self, record, status):
+        config = profiling_config()
+        with self.lock:
+            self.active.remove(record)
+            if not self.active:
+                self.busy.clear()
+
+        del record["thread"], record["frame"]
+        duration_ms = (time.perf_counter() - record.pop("started")) * 1000
+        route = getattr(record.pop("scope").get("route"), "path", None)
+        slow = duration_ms >= float(config["slow_ms"])
+        if slow:
+            print(f"[Slow Request] {record['method']} {record['path']} took {duration_ms:.0f} ms")
+        pattern = config["routes"]
+        matched = bool(pattern) and any(re.search(pattern, p) for p in (record["path"], route) if p)
+        if not (slow or matched):
+            return
+
+        record.update({"route": route, "status": status, "duration_ms": round(duration_ms, 1)})
+        with self.lock:
+            if self.profiles.maxlen != int(config["keep"]):
+                self.profiles = deque(self.profiles, maxlen=int(config["keep"]))
+            record["id"] = self.next_id
+            self.next_id += 1
+            self.profiles.append(record)
+
+    def run(self):
+        while True:
+            self.busy.wait()
+            time.sleep(float(profiling_config()["interval_ms"]) / 1000)
+            self.sample()
+
+    def sample(self):
+        frames = sys._current_frames()
+        me = threading.get_ident()
+        with self.lock:
+            # Requests whose endpoint has started, by the thread it runs on
+            owners = {}
+            for record in self.active:
+                if record["frame"] is not None:
+                    owners.setdefault(record["thread"], {})[id(record["frame"])] = record
+            if not owners:
+                return
+
+            for ident, frame in frames.items():
+                if ident == me or ident not in owners:
+                    continue
+                # Async endpoints share the event loop thread, but only the
+                # running one has its caller's frame on the stack
+                callers = owners[ident]
+                stack = []
+                while frame is not None and id(frame) not in callers:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                if frame is None:
+                    continue  # not inside a profiled endpoint right now
+                record = callers[id(frame)]
+                record["stacks"][";".join(frame_label(code) for code in reversed(stack))] += 1
+                record["samples"] += 1
+
+    def summaries(self):
+        with self.lock:
+            profiles = list(self.profiles)
+        return [
+            {key: record[key] for key in ("id", "method", "path", "route", "status", "started_at", "duration_ms", "samples")}
+            for record in reversed(profiles)
+        ]
+
+    def collapsed(self, profile_id):
+        with self.lock:
+            record = next((r for r in self.profiles if r["id"] == profile_id), None)
+        if record is None:
+            return None
+        return "".join(f"{stack} {count}\n" for stack, count in record["stacks"].most_common())
+
+
+request_profiler = RequestProfiler()
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.get("PROFILING", {}).get("enabled"):
+            await self.app(scope, receive, send)
+            return
+
+        record = request_profiler.begin(scope)
+        token = profiled_request.set(record)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            profiled_request.reset(token)
+            request_profiler.end(record, status)
+
+
+app.add_middleware(ProfilingMiddleware)
+
+class ProfilingConfig(BaseModel):
+    enabled: bool = PROFILING_DEFAULTS["enabled"]
+    routes: str = PROFILING_DEFAULTS["routes"]
+    slow_ms: float = PROFILING_DEFAULTS["slow_ms"]
+    interval_ms: float = PROFILING_DEFAULTS["interval_ms"]
+    keep: int = PROFILING_DEFAULTS["keep"]
+
+@app.get("/profiling")
+def get_profiling():
+    return {**profiling_config(), "profiles": len(request_profiler.profiles)}
+
+@app.post("/profiling")
+def update_profiling(data: ProfilingConfig, auth=Depends(verify_api_key)):
+    try:
+        re.compile(data.routes)
+    except re.error as e:
+        raise HTTPException(status_code=400, detail=f"Invalid routes pattern: {e}")
+    if data.interval_ms <= 0 or data.keep < 1:
+        raise HTTPException(status_code=400, detail="interval_ms must be positive and keep at least 1")
+    try:
+        config = {**settings, "PROFILING": data.dict()}
+        save_settings(config)
+        return {"status": "success", **profiling_config()}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"status": "error", "detail": str(e)})
+
+@app.get("/profiles")
+def list_profiles(auth=Depends(verify_api_key)):
+    return request_profiler.summaries()
+
+@app.get("/profiles/{profile_id}")
+def get_profile(profile_id: int, auth=Depends(verify_api_key)):
+    collapsed = request_profiler.collapsed(profile_id)
+    if collapsed is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return Response(collapsed, media_type="text/plain")
+
+
+# ========== Database ==========
+# One long-lived connection per thread instead of a connect/close per call.
+# WAL lets the webhook writers and the analytics readers run side by side,
+# and because every call site passes a constant SQL string, sqlite3's
+# per-connection statement cache reuses the prepared statements.
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+DB_STATEMENT_CACHE = 256
+
+_db_local = threading.local()
+
+def get_db():
+    conn = getattr(_db_local, "conn", None)
+    if conn is None or _db_local.path != DB_FILE:
+        if conn is not None:
+            conn.close()
+        conn = sqlite3.connect(DB_FILE, timeout=5, cached_statements=DB_STATEMENT_CACHE)
+        for pragma in DB_PRAGMAS:
+            conn.execute(pragma)
+        _db_local.conn = conn
+        _db_local.path = DB_FILE
+    return conn
+
+def open_db_reader():
+    """Open a separate connection for long reads such as streamed exports.
+
+    Streaming responses are iterated from more than one threadpool thread,
+    so they cannot borrow a thread's shared connection.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=5, check_same_thread=False)
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+@contextmanager
+def db_transaction():
+    """Yield this thread's connection; commit on success, roll back on error."""
+    conn = get_db()
+    started = time.perf_counter()
+    try:
+        yield conn
+        committing = time.perf_counter()
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    SQLITE_TRANSACTION_SECONDS.observe(committing - started, "statements")
+    SQLITE_TRANSACTION_SECONDS.observe(time.perf_counter() - committing, "commit")
+
+
+def to_float_or_none(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def sent_log_row(data, now):
+    if data.get("At"):
+        now = datetime.strptime(data["At"], "%Y-%m-%d %H:%M:%S")
+    return (
         now.strftime("%Y-%m-%d"),
         now.strftime("%H:%M:%S"),
         data.get("OD", ""),
         data.get("CH", ""),
         data.get("Section", ""),
-        data.get("LineWalker", "")
-    ))
-    conn.commit()
-    conn.close()
+        data.get("LineWalker", ""),
+        int(now.timestamp()),
+        to_float_or_none(data.get("CH"))
+    )
+
+def insert_sent_logs(conn, events, now):
+    # Events may carry their own "At" timestamp; the rest are logged at `now`
+    rows = [sent_log_row(data, now) for data in events]
+    conn.executemany('''INSERT INTO sent_logs (date, time, od, ch, section, linewalker, ts, ch_num)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+    update_shift_counts(conn, rows)
+    update_hotspot_cells(conn, rows)
+
+def insert_sent_log(conn, data, now):
+    insert_sent_logs(conn, [data], now)
+
+def log_message_sqlite(data, now=None):
+    now = now or datetime.now()
+    with db_transaction() as conn:
+        insert_sent_log(conn, data, now)
+    live_feed.notify()
+
+# ========== Shared State ==========
+# Settings, line walker assignments and section tables live in the
+# shared_state table so that every uvicorn worker serves the same values.
+# Each write takes the next number of one global version sequence. At the
+# start of every request a worker compares the highest version with the one
+# it last synced (a MAX over a handful of rows) and reloads only the keys
+# that changed. settings.json and linewalkers.json are still written as a
+# mirror and seed an empty store.
+#
+# Background roles that must run once per deployment rather than once per
+# worker (the outbox dispatcher, retention) hold a short lease in the
+# leases table.
+LEASE_TTL = 60.0
+WORKER_ID = f"{platform.node()}:{os.getpid()}"
+
+state_lock = threading.RLock()
+state_versions = {}  # key -> version applied in this worker
+state_synced = 0  # highest version this worker has synced from the store
+
+def state_appliers():
+    return {
+        "settings": apply_settings,
+        "linewalkers": set_linewalker_data,
+        "sections": lambda value: activate_section_tables(value["tables"]),
+    }
+
+def write_shared_state(conn, key, value):
+    conn.execute('''
+        INSERT INTO shared_state (key, version, value, updated_at)
+        VALUES (?, (SELECT COALESCE(MAX(version), 0) + 1 FROM shared_state), ?, ?)
+        ON CONFLICT(key) DO UPDATE SET
+            version = excluded.version, value = excluded.value, updated_at = excluded.updated_at
+    ''', (key, json.dumps(value), datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    return conn.execute("SELECT version FROM shared_state WHERE key = ?", (key,)).fetchone()[0]
+
+def read_shared_state(key):
+    row = get_db().execute("SELECT version, value FROM shared_state WHERE key = ?", (key,)).fetchone()
+    return (row[0], json.loads(row[1])) if row else (None, None)
+
+def apply_state(key, version, value):
+    with state_lock:
+        if version <= state_versions.get(key, 0):
+            return  # already have this or a newer value
+        state_appliers()[key](value)
+        state_versions[key] = version
+
+def publish_state(key, value):
+    """Store a new value for every worker and apply it in this one now."""
+    with db_transaction() as conn:
+        version = write_shared_state(conn, key, value)
+    apply_state(key, version, value)
+
+def update_state(key, change):
+    """Read-modify-write under the database write lock.
+
+    `change` gets the current value and returns the new one, or None to
+    leave it alone. Returns the value that was written, or None.
+    """
+    with db_transaction() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT value FROM shared_state WHERE key = ?", (key,)).fetchone()
+        value = change(json.loads(row[0]) if row else None)
+        if value is None:
+            return None
+        version = write_shared_state(conn, key, value)
+    apply_state(key, version, value)
+    return value
+
+def seed_state(key, value):
+    """Store a starting value unless some worker already did."""
+    with db_transaction() as conn:
+        conn.execute('''
+            INSERT INTO shared_state (key, version, value, updated_at)
+            VALUES (?, (SELECT COALESCE(MAX(version), 0) + 1 FROM shared_state), ?, ?)
+            ON CONFLICT(key) DO NOTHING
+        ''', (key, json.dumps(value), datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+def sync_shared_state():
+    """Apply whatever other workers have published since the last sync."""
+    global state_synced
+    conn = get_db()
+    latest = conn.execute("SELECT MAX(version) FROM shared_state").fetchone()[0] or 0
+    if latest <= state_synced:
+        return
+    with state_lock:
+        rows = conn.execute(
+            "SELECT key, version, value FROM shared_state WHERE version > ? ORDER BY version",
+            (state_synced,)
+        ).fetchall()
+        for key, version, value in rows:
+            apply_state(key, version, json.loads(value))
+        state_synced = max([state_synced] + [version for _, version, _ in rows])
+
+def hold_lease(name):
+    """Take or renew a lease; True while this worker owns the role."""
+    now = time.time()
+    with db_transaction() as conn:
+        cur = conn.execute('''
+            INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+        ''', (name, WORKER_ID, now + LEASE_TTL, now))
+    return cur.rowcount == 1
+
+def release_leases(name=None):
+    """Give up one lease, or all of this worker's leases."""
+    with db_transaction() as conn:
+        conn.execute("DELETE FROM leases WHERE owner = ? AND (? IS NULL OR name = ?)", (WORKER_ID, name, name))
+
+def data_version(conn):
+    # Changes whenever another connection, in any process, commits
+    return conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+class SharedStateMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            sync_shared_state()
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(SharedStateMiddleware)
+
+@app.get("/shared_state")
+def shared_state():
+    rows = get_db().execute("SELECT key, version, updated_at FROM shared_state ORDER BY key").fetchall()
+    return {
+        "worker": WORKER_ID,
+        "synced_version": state_synced,
+        "keys": [
+            {"key": key, "version": version, "updated_at": updated_at, "applied_version": state_versions.get(key)}
+            for key, version, updated_at in rows
+        ]
+    }
+
+# ========== Shift Aggregates ==========
+# Alarm counts per 06:30-to-06:30 shift, by section, line walker and hour,
+# kept in the small shift_counts table. Every sent_logs insert bumps them
+# in the same transaction, and they are rebuilt from sent_logs on startup,
+# so dashboards read a handful of rows instead of scanning the history.
+# Shifts that start before the end of the newest archived month keep their
+# counts, since part of their rows are no longer in sent_logs.
+# A shift is keyed by the date on which it starts.
+SHIFT_DIMENSIONS = ("section", "linewalker", "hour")
+
+def shift_key(moment):
+    return (moment - timedelta(hours=6, minutes=30)).strftime("%Y-%m-%d")
+
+def update_shift_counts(conn, rows):
+    counts = Counter()
+    for date, time_str, _od, _ch, section, linewalker, _ts, _ch_num in rows:
+        shift = shift_key(datetime.strptime(f"{date} {time_str}", "%Y-%m-%d %H:%M:%S"))
+        counts[(shift, "section", section)] += 1
+        counts[(shift, "linewalker", linewalker)] += 1
+        counts[(shift, "hour", time_str[:2])] += 1
+    conn.executemany('''
+        INSERT INTO shift_counts (shift, dimension, key, count) VALUES (?, ?, ?, ?)
+        ON CONFLICT (shift, dimension, key) DO UPDATE SET count = count + excluded.count
+    ''', [(shift, dim, key, n) for (shift, dim, key), n in counts.items()])
+
+def rebuild_shift_counts():
+    # Same shift rule as shift_key: before 06:30 belongs to the previous day
+    shift_expr = "CASE WHEN time >= '06:30:00' THEN date ELSE date(date, '-1 day') END"
+    archived = [index["month"] for index in list_archives("sent_logs")]
+    first_shift = month_start(datetime.strptime(max(archived), "%Y-%m"), -1).strftime("%Y-%m-%d") if archived else ""
+    with db_transaction() as conn:
+        conn.execute("DELETE FROM shift_counts WHERE shift >= ?", (first_shift,))
+        for dimension, column in (("section", "section"), ("linewalker", "linewalker"), ("hour", "substr(time, 1, 2)")):
+            conn.execute(f'''
+                INSERT INTO shift_counts (shift, dimension, key, count)
+                SELECT {shift_expr} AS shift, '{dimension}', {column}, COUNT(*)
+                FROM sent_logs
+                WHERE date IS NOT NULL AND time IS NOT NULL AND shift >= ?
+                GROUP BY 1, 3
+            ''', (first_shift,))
+
+def get_shift_counts(shift):
+    result = {dimension: {} for dimension in SHIFT_DIMENSIONS}
+    rows = get_db().execute(
+        "SELECT dimension, key, count FROM shift_counts WHERE shift = ? ORDER BY count DESC",
+        (shift,)
+    ).fetchall()
+    for dimension, key, count in rows:
+        result[dimension][key] = count
+    return result
+
+# ========== Alarm Hotspots ==========
+# Alarm counts binned by CH (bin_km wide), section and hour of day, kept in
+# hotspot_cells twice: per day ("YYYY-MM-DD") and rolled up per month
+# ("YYYY-MM"). Every sent_logs insert bumps both in the same transaction.
+# A date range reads the month cells for the whole months it covers and day
+# cells only for the ragged ends, so a query over years touches a few
+# thousand cells, never the alarms themselves. The cells outlive archiving;
+# they are only rebuilt (archives included) when the bin width changes.
+# The rebuild counts into a shadow table in short transactions, so alarms
+# keep being logged meanwhile. One last short transaction bins the alarms
+# logged since it started, swaps the shadow table in and stores the new
+# width. Inserts read the width from the stored settings inside their own
+# transaction, so every cell is binned at whichever width was committed
+# before it, in any worker.
+HOTSPOT_DEFAULTS = {"bin_km": 1.0}
+HOTSPOT_TOP = 20
+HOTSPOT_DEFAULT_DAYS = 28
+HOTSPOT_CELLS_COLUMNS = "period TEXT, section TEXT, bin INTEGER, hour INTEGER, count INTEGER, PRIMARY KEY (period, section, bin, hour)"
+HOTSPOT_REBUILD_ATTEMPTS = 3  # restarts when archiving moves alarms mid-rebuild
+hotspot_rebuild_lock = threading.Lock()  # the "hotspots" lease is per worker, this is per thread
+
+def hotspot_config():
+    return {**HOTSPOT_DEFAULTS, **settings.get("HOTSPOTS", {})}
+
+def hotspot_cell_counts(rows, bin_km):
+    """Counter of (period, section, bin, hour) over (date, time, section, ch_num) rows."""
+    counts = Counter()
+    for date, time_str, section, ch in rows:
+        if ch is None or not date or not time_str:
+            continue
+        cell = (section, int(ch // bin_km), int(time_str[:2]))
+        counts[(date,) + cell] += 1
+        counts[(date[:7],) + cell] += 1
+    return counts
+
+def upsert_hotspot_cells(conn, counts, table="hotspot_cells"):
+    conn.executemany(f'''
+        INSERT INTO {table} (period, section, bin, hour, count) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (period, section, bin, hour) DO UPDATE SET count = count + excluded.count
+    ''', [key + (n,) for key, n in counts.items()])
+
+def update_hotspot_cells(conn, rows):
+    row = conn.execute("SELECT json_extract(value, '$.HOTSPOTS.bin_km') FROM shared_state WHERE key = 'settings'").fetchone()
+    bin_km = float(row[0]) if row and row[0] else HOTSPOT_DEFAULTS["bin_km"]
+    cells = [(date, time_str, section, ch_num) for date, time_str, _od, _ch, section, _lw, _ts, ch_num in rows]
+    upsert_hotspot_cells(conn, hotspot_cell_counts(cells, bin_km))
+
+def rebuild_hotspot_cells(conn, bin_km):
+    """Recount every cell from sent_logs and the sent_logs archives; run inside a transaction."""
+    conn.execute("DELETE FROM hotspot_cells")
+    cur = conn.execute("SELECT date, time, section, ch_num FROM sent_logs")
+    while True:
+        chunk = cur.fetchmany(EXPORT_CHUNK)
+        if not chunk:
+            break
+        upsert_hotspot_cells(conn, hotspot_cell_counts(chunk, bin_km))
+    for part in archived_rows("sent_logs", None, None):
+        rows = ((row.get("date"), row.get("time"), row.get("section"), row.get("ch_num")) for row in part)
+        upsert_hotspot_cells(conn, hotspot_cell_counts(rows, bin_km))
+    return conn.execute("SELECT COUNT(*) FROM hotspot_cells WHERE length(period) = 10").fetchone()[0]
+
+def archive_state(table):
+    return [(index["month"], index["max_id"]) for index in list_archives(table)]
+
+def renew_hotspot_lease():
+    # Whoever holds the lease owns hotspot_cells_next; a rebuild that outlives it must stop
+    if not hold_lease("hotspots"):
+        raise RuntimeError("Another worker took over the hotspot rebuild")
+
+def rebin_hotspot_cells(hotspots):
+    """Rebuild every cell at hotspots["bin_km"] and store it in the settings.
+
+    Returns (settings version, settings, day cells). Only the final swap
+    holds the write lock; the caller holds the "hotspots" lease.
+    """
+    bin_km = float(hotspots["bin_km"])
+    for _attempt in range(HOTSPOT_REBUILD_ATTEMPTS):
+        archives = archive_state("sent_logs")
+        with db_transaction() as conn:
+            conn.execute("DROP TABLE IF EXISTS hotspot_cells_next")
+            conn.execute(f"CREATE TABLE hotspot_cells_next ({HOTSPOT_CELLS_COLUMNS})")
+            last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM sent_logs").fetchone()[0]
+
+        after = 0
+        while True:
+            chunk = get_db().execute(
+                "SELECT id, date, time, section, ch_num FROM sent_logs WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+                (after, last_id, EXPORT_CHUNK)
+            ).fetchall()
+            if not chunk:
+                break
+            after = chunk[-1][0]
+            counts = hotspot_cell_counts((row[1:] for row in chunk), bin_km)
+            renew_hotspot_lease()
+            with db_transaction() as conn:
+                upsert_hotspot_cells(conn, counts, "hotspot_cells_next")
+        for part in archived_rows("sent_logs", None, None):
+            counts = hotspot_cell_counts(((row.get("date"), row.get("time"), row.get("section"), row.get("ch_num")) for row in part), bin_km)
+            renew_hotspot_lease()
+            with db_transaction() as conn:
+                upsert_hotspot_cells(conn, counts, "hotspot_cells_next")
+
+        renew_hotspot_lease()
+        with db_transaction() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if archive_state("sent_logs") != archives:
+                continue  # alarms moved between sent_logs and the archives while counting
+            # Logged since the snapshot, so binned at the old width so far
+            logged = conn.execute("SELECT date, time, section, ch_num FROM sent_logs WHERE id > ?", (last_id,)).fetchall()
+            upsert_hotspot_cells(conn, hotspot_cell_counts(logged, bin_km), "hotspot_cells_next")
+            conn.execute("DROP TABLE hotspot_cells")
+            conn.execute("ALTER TABLE hotspot_cells_next RENAME TO hotspot_cells")
+            row = conn.execute("SELECT value FROM shared_state WHERE key = 'settings'").fetchone()
+            config = {**(json.loads(row[0]) if row else settings), "HOTSPOTS": hotspots}
+            version = write_shared_state(conn, "settings", config)
+            cells = conn.execute("SELECT COUNT(*) FROM hotspot_cells WHERE length(period) = 10").fetchone()[0]
+        return version, config, cells
+    raise RuntimeError("Alarms kept being archived during the hotspot rebuild; try again")
+
+def hotspot_periods(first, last):
+    """Split the days first..last into (day ranges, whole months) for hotspot_cells."""
+    day_ranges, months = [], []
+    start = month_start(first, 0) if first.day == 1 else month_start(first, -1)
+    end = month_start(last + timedelta(days=1), 0)  # just past the last whole month
+    if start < end:
+        if first < start:
+            day_ranges.append((first, start - timedelta(days=1)))
+        month = start
+        while month < end:
+            months.append(month.strftime("%Y-%m"))
+            month = month_start(month, -1)
+        if end <= last:
+            day_ranges.append((end, last))
+    else:
+        day_ranges.append((first, last))
+    return day_ranges, months
+
+def query_hotspot_cells(first, last, section=None):
+    """{(section, bin): [count per hour]} for the days first..last inclusive."""
+    day_ranges, months = hotspot_periods(first, last)
+    clauses, params = [], []
+    for lo, hi in day_ranges:
+        clauses.append("(length(period) = 10 AND period BETWEEN ? AND ?)")
+        params += [lo.strftime("%Y-%m-%d"), hi.strftime("%Y-%m-%d")]
+    if months:
+        clauses.append(f"period IN ({', '.join('?' * len(months))})")
+        params += months
+    where = " OR ".join(clauses)
+    if section is not None:
+        where = f"({where}) AND section = ?"
+        params.append(section)
+
+    cells = {}
+    rows = get_db().execute(f"""
+        SELECT section, bin, hour, SUM(count) FROM hotspot_cells
+        WHERE {where}
+        GROUP BY section, bin, hour
+    """, params).fetchall()
+    for cell_section, bin_index, hour, count in rows:
+        cells.setdefault((cell_section, bin_index), [0] * 24)[hour] += count
+    return cells
+
+def parse_hotspot_range(start, end):
+    try:
+        last = datetime.strptime(end, "%Y-%m-%d") if end else datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        first = datetime.strptime(start, "%Y-%m-%d") if start else last - timedelta(days=HOTSPOT_DEFAULT_DAYS - 1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date. Use YYYY-MM-DD")
+    if first > last:
+        raise HTTPException(status_code=400, detail="start is after end")
+    return first, last
+
+class HotspotConfig(BaseModel):
+    bin_km: float
+
+@app.get("/hotspot_config")
+def get_hotspot_config():
+    return hotspot_config()
+
+@app.post("/hotspot_config")
+def update_hotspot_config(data: HotspotConfig, auth=Depends(verify_api_key)):
+    if data.bin_km <= 0:
+        raise HTTPException(status_code=400, detail="bin_km must be positive")
+    if not hold_lease("hotspots"):
+        raise HTTPException(status_code=409, detail="Hotspots are already being rebuilt in another worker")
+    try:
+        with hotspot_rebuild_lock:
+            version, config, cells = rebin_hotspot_cells(data.dict())
+        apply_state("settings", version, config)
+        write_settings_file(config)
+        print(f"[Hotspots] Rebuilt {cells} day cells at {data.bin_km} km bins")
+        return {"status": "success", **hotspot_config(), "day_cells": cells}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"status": "error", "detail": str(e)})
+    finally:
+        release_leases("hotspots")
 
 # ========== Settings and Linewalkers ==========
 
@@ -108,11 +989,86 @@ def save_linewalkers(data):
     with open(LINEWALKER_FILE, 'w') as f:
         json.dump(data, f, indent=2)
 
+class LineWalkerIndex:
+    """Sorted interval index over line walker CH ranges.
+
+    All range boundaries are sorted once, and every point boundary and open
+    span between two boundaries is resolved up front to the entry the old
+    linear scan would have picked (the first one in file order). A lookup is
+    then a single bisect.
+    """
+
+    def __init__(self, entries):
+        self.bounds = sorted({float(e["start_ch"]) for e in entries} | {float(e["end_ch"]) for e in entries})
+        # Region 2k is the boundary point bounds[k], region 2k+1 is the open
+        # span (bounds[k], bounds[k + 1]).
+        self.regions = [None] * max(2 * len(self.bounds) - 1, 0)
+        for entry in entries:
+            lo = bisect.bisect_left(self.bounds, float(entry["start_ch"]))
+            hi = bisect.bisect_left(self.bounds, float(entry["end_ch"]))
+            for region in range(2 * lo, 2 * hi + 1):
+                if self.regions[region] is None:
+                    self.regions[region] = entry["line_walker"]
+
+        self.overlaps, self.gaps = self._check_ranges(entries)
+        for a, b in self.overlaps:
+            print(f"[Linewalker Index] Overlap: {a[0]}-{a[1]} and {b[0]}-{b[1]}")
+        for start, end in self.gaps:
+            print(f"[Linewalker Index] Gap: no line walker range covers {start}-{end}")
+
+    @staticmethod
+    def _check_ranges(entries):
+        overlaps, gaps = [], []
+        ranges = sorted((float(e["start_ch"]), float(e["end_ch"])) for e in entries)
+        if not ranges:
+            return overlaps, gaps
+
+        # Ranges that only touch at a boundary (297-311 after 285-297) are
+        # neither an overlap nor a gap.
+        widest = ranges[0]
+        for current in ranges[1:]:
+            if current[0] < widest[1]:
+                overlaps.append((widest, current))
+            elif current[0] > widest[1]:
+                gaps.append((widest[1], current[0]))
+            if current[1] > widest[1]:
+                widest = current
+        return overlaps, gaps
+
+    def report(self):
+        return {
+            "overlaps": [{"first": list(a), "second": list(b)} for a, b in self.overlaps],
+            "gaps": [{"start_ch": start, "end_ch": end} for start, end in self.gaps],
+        }
+
+    def lookup(self, ch):
+        k = bisect.bisect_left(self.bounds, ch)
+        if k < len(self.bounds) and self.bounds[k] == ch:
+            return self.regions[2 * k]
+        if 0 < k < len(self.bounds):
+            return self.regions[2 * k - 1]
+        return None
+
+    def lookup_many(self, chs):
+        return [self.lookup(ch) for ch in chs]
+
+
+linewalker_lock = threading.RLock()
+
+def set_linewalker_data(data):
+    # Build the new index first, then swap both globals so requests never see
+    # a half-built index.
+    global linewalker_data, linewalker_index
+    with linewalker_lock:
+        index = LineWalkerIndex(data)
+        linewalker_data, linewalker_index = data, index
+        schedule_linewalker_expiry(data)
+
 def refresh_linewalkers():
-    global linewalker_data
-    linewalker_data = load_linewalkers()
+    seed_state("linewalkers", load_linewalkers())
 
-linewalker_data = load_linewalkers()
+linewalker_data = []
+linewalker_index = LineWalkerIndex([])
 
 # ========== Section Data ==========
 section_files = {
@@ -123,58 +1079,319 @@ section_files = {
     "SV-11 to KRS": "OD_CH_5.csv"
 }
 section_data = {}
-for section, file in section_files.items():
+section_engines = {}
+
+def read_section_table(path):
+    """Parse one OD_CH CSV into columns sorted by OD.
+
+    Rows with a blank OD or CH are skipped, and Diff is recomputed as the
+    OD step from the previous row (0 for the first).
+    """
+    points = []
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for record in csv.DictReader(f):
+            try:
+                points.append((float(record["OD"]), float(record["CH"])))
+            except (TypeError, ValueError):
+                continue
+    points.sort(key=lambda p: p[0])
+
+    od = [p[0] for p in points]
+    ch = [p[1] for p in points]
+    diff = [0.0] + [b - a for a, b in zip(od, od[1:])]
+    return {"OD": od, "CH": ch, "Diff": diff}
+
+# Parsed tables are kept in one NumPy archive together with the SHA-256 of
+# every source CSV. Startup loads the archive when all checksums still
+# match and only re-parses the CSVs when one of them has changed.
+SECTION_CACHE_FILE = "section_cache.npz"
+SECTION_CACHE_VERSION = 1
+section_reload_lock = threading.Lock()
+
+def file_sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def validate_section_table(table):
+    """Return a list of problems that make a table unsafe to interpolate."""
+    errors = []
+    od, ch = table["OD"], table["CH"]
+    if len(od) < 2:
+        errors.append("needs at least two OD/CH rows")
+        return errors
+
+    duplicates = sorted({a for a, b in zip(od, od[1:]) if a == b})
+    if duplicates:
+        errors.append(f"duplicate OD breakpoints: {', '.join(f'{v:g}' for v in duplicates)}")
+
+    steps = [b - a for a, b in zip(ch, ch[1:])]
+    rising = all(s > 0 for s in steps)
+    falling = all(s < 0 for s in steps)
+    if not (rising or falling):
+        direction = 1 if ch[-1] > ch[0] else -1
+        bad = [od[i + 1] for i, s in enumerate(steps) if s * direction <= 0]
+        errors.append(f"CH is not strictly monotonic along OD (check OD {', '.join(f'{v:g}' for v in bad[:10])})")
+    return errors
+
+def compile_section_tables():
+    """Parse and validate every section CSV; returns (tables, errors, checksums)."""
+    tables, errors, checksums = {}, {}, {}
+    for section, file in section_files.items():
+        try:
+            checksums[section] = file_sha256(file)
+            tables[section] = read_section_table(file)
+        except Exception as e:
+            errors[section] = [f"could not load {file}: {e}"]
+            continue
+        problems = validate_section_table(tables[section])
+        if problems:
+            errors[section] = problems
+    return tables, errors, checksums
+
+def write_section_cache(tables, checksums):
+    manifest = {
+        "version": SECTION_CACHE_VERSION,
+        "sections": [{"name": s, "file": section_files[s], "sha256": checksums[s]} for s in tables]
+    }
+    arrays = {"manifest": np.array(json.dumps(manifest))}
+    for i, table in enumerate(tables.values()):
+        for column in ("OD", "CH", "Diff"):
+            arrays[f"{i}_{column}"] = np.asarray(table[column], dtype=float)
+
+    # Write beside the target and rename, so readers never see half a file
+    tmp_path = SECTION_CACHE_FILE + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, SECTION_CACHE_FILE)
+
+def read_section_cache():
+    """Return (tables, checksums) if the archive matches the current CSVs, else None."""
+    if not os.path.exists(SECTION_CACHE_FILE):
+        return None
     try:
-        df = pd.read_csv(file)
-        df = df.dropna(subset=["OD", "CH"])
-        df = df.sort_values("OD")
-        df["Diff"] = df["OD"].diff().fillna(0)
-        section_data[section] = df.reset_index(drop=True)
+        with np.load(SECTION_CACHE_FILE, allow_pickle=False) as archive:
+            manifest = json.loads(str(archive["manifest"]))
+            entries = manifest["sections"]
+            if manifest.get("version") != SECTION_CACHE_VERSION:
+                return None
+            if [(e["name"], e["file"]) for e in entries] != list(section_files.items()):
+                return None
+            for entry in entries:
+                if file_sha256(entry["file"]) != entry["sha256"]:
+                    return None
+            tables = {
+                entry["name"]: {column: archive[f"{i}_{column}"].tolist() for column in ("OD", "CH", "Diff")}
+                for i, entry in enumerate(entries)
+            }
+            return tables, {entry["name"]: entry["sha256"] for entry in entries}
     except Exception as e:
-        print(f"Error loading {file} for section {section}: {e}")
+        print(f"[Sections] Ignoring unreadable cache {SECTION_CACHE_FILE}: {e}")
+        return None
+
+def activate_section_tables(tables):
+    # Engines are built before either global changes hands
+    global section_data, section_engines
+    global chainage_index
+    engines = {section: SectionInterpolator(table) for section, table in tables.items()}
+    index = ChainageIndex(tables)
+    section_data, section_engines, chainage_index = tables, engines, index
+
+def load_section_tables():
+    cached = read_section_cache()
+    if cached is not None:
+        publish_section_tables(*cached)
+        return
+
+    tables, errors, checksums = compile_section_tables()
+    for section, problems in errors.items():
+        for problem in problems:
+            print(f"Error loading {section_files[section]} for section {section}: {problem}")
+    tables = {s: t for s, t in tables.items() if s in checksums}
+    publish_section_tables(tables, checksums)
+    if not errors:
+        try:
+            write_section_cache(tables, checksums)
+        except OSError as e:
+            print(f"[Sections] Could not write {SECTION_CACHE_FILE}: {e}")
+
+def publish_section_tables(tables, checksums):
+    # Workers starting from the same CSVs reuse the stored tables
+    version, stored = read_shared_state("sections")
+    if stored is not None and stored["checksums"] == checksums:
+        apply_state("sections", version, stored)
+    else:
+        publish_state("sections", {"checksums": checksums, "tables": tables})
+
+@app.post("/reload_sections")
+def reload_sections(auth=Depends(verify_api_key)):
+    with section_reload_lock:
+        tables, errors, checksums = compile_section_tables()
+        if errors:
+            # Keep serving the current tables
+            return JSONResponse(status_code=422, content={"status": "error", "errors": errors})
+        try:
+            write_section_cache(tables, checksums)
+        except OSError as e:
+            print(f"[Sections] Could not write {SECTION_CACHE_FILE}: {e}")
+        publish_state("sections", {"checksums": checksums, "tables": tables})
+
+    print(f"[Sections] Reloaded {len(tables)} section tables")
+    return {
+        "status": "reloaded",
+        "sections": {section: len(table["OD"]) for section, table in tables.items()}
+    }
 
 # ========== Interpolation ==========
-def interpolate_ch(df, od):
-    ch_matches = []
-    for i in range(len(df) - 1):
-        od1 = df.loc[i, "OD"]
-        od2 = df.loc[i + 1, "OD"]
-        ch1 = df.loc[i, "CH"]
-        ch2 = df.loc[i + 1, "CH"]
-        diff = df.loc[i, "Diff"]
-        if od1 <= od <= od2 and diff != 0:
-            od_diff = od - od1
-            ch = ch1 + ((ch2 - ch1) * od_diff / diff)
-            ch_matches.append(round(ch, 3))
-    return ch_matches  # Always returns a list
-
-def interpolate_od(df, ch):
-    for i in range(len(df) - 1):
-        ch1 = df.loc[i, "CH"]
-        ch2 = df.loc[i + 1, "CH"]
-        od1 = df.loc[i, "OD"]
-        od2 = df.loc[i + 1, "OD"]
-        if ch1 <= ch <= ch2:
+class SectionInterpolator:
+    """OD -> CH lookup for one section, precompiled into NumPy arrays.
+
+    Segment i runs from row i to row i + 1 of the sorted section table and is
+    scaled by that table's ``Diff`` value for row i, exactly like the old
+    row-by-row loop. An OD that sits on a shared breakpoint (or inside
+    overlapping segments) matches every segment that contains it, so callers
+    still get one CH per match.
+    """
+
+    def __init__(self, table):
+        od = np.asarray(table["OD"], dtype=float)
+        ch = np.asarray(table["CH"], dtype=float)
+        diff = np.asarray(table["Diff"], dtype=float)
+
+        self.od_start = od[:-1]
+        self.od_end = od[1:]
+        self.ch_start = ch[:-1]
+        self.ch_end = ch[1:]
+        self.diff = diff[:-1]
+        self.valid = self.diff != 0
+
+    def _segment_bounds(self, ods):
+        # Both breakpoint arrays are sorted, so the segments containing an OD
+        # are the contiguous run [first, last) found by two binary searches.
+        first = np.searchsorted(self.od_end, ods, side="left")
+        last = np.searchsorted(self.od_start, ods, side="right")
+        return first, last
+
+    def ch_for_od(self, od):
+        return self.ch_for_ods([od])[0]
+
+    def ch_for_ods(self, ods):
+        ods = np.asarray(ods, dtype=float)
+        first, last = self._segment_bounds(ods)
+
+        # Flatten every (OD, segment) match into one array so the whole batch
+        # is interpolated in a single vectorized pass.
+        counts = np.clip(last - first, 0, None)
+        owner = np.repeat(np.arange(len(ods)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        idx = np.repeat(first, counts) + offsets
+
+        keep = self.valid[idx]
+        idx, owner = idx[keep], owner[keep]
+        ch1 = self.ch_start[idx]
+        ch = ch1 + ((self.ch_end[idx] - ch1) * (ods[owner] - self.od_start[idx]) / self.diff[idx])
+
+        results = [[] for _ in range(len(ods))]
+        for i, value in zip(owner.tolist(), np.round(ch, 3).tolist()):
+            results[i].append(value)
+        return results  # One list per OD, like interpolate_ch
+
+
+class ChainageIndex:
+    """CH -> (section, OD) lookup across every section table at once.
+
+    Works like LineWalkerIndex: the CH end points of every segment in every
+    section are sorted once and each boundary point and open span between
+    two boundaries is resolved up front to the segments that cover it. A
+    lookup is a single bisect followed by one interpolation per candidate.
+    Unlike interpolate_od, segments whose CH falls along the OD direction
+    (SV-09 to SV-08, SV-11 to SV-10) are indexed too.
+    """
+
+    def __init__(self, tables):
+        # (section, od1, od2, ch1, ch2) in section order, then OD order
+        self.segments = []
+        for section, table in tables.items():
+            ods, chs = table["OD"], table["CH"]
+            for i in range(len(ods) - 1):
+                if chs[i] != chs[i + 1]:
+                    self.segments.append((section, ods[i], ods[i + 1], chs[i], chs[i + 1]))
+
+        self.bounds = sorted({s[3] for s in self.segments} | {s[4] for s in self.segments})
+        # Region 2k is the boundary point bounds[k], region 2k+1 is the open
+        # span (bounds[k], bounds[k + 1]).
+        self.regions = [[] for _ in range(max(2 * len(self.bounds) - 1, 0))]
+        for n, (_section, _od1, _od2, ch1, ch2) in enumerate(self.segments):
+            lo = bisect.bisect_left(self.bounds, min(ch1, ch2))
+            hi = bisect.bisect_left(self.bounds, max(ch1, ch2))
+            for region in range(2 * lo, 2 * hi + 1):
+                self.regions[region].append(n)
+
+    def _covering(self, ch):
+        k = bisect.bisect_left(self.bounds, ch)
+        if k < len(self.bounds) and self.bounds[k] == ch:
+            return self.regions[2 * k]
+        if 0 < k < len(self.bounds):
+            return self.regions[2 * k - 1]
+        return []
+
+    def lookup(self, ch):
+        """Every (section, OD) at this CH; a shared breakpoint is listed once."""
+        candidates = []
+        for n in self._covering(ch):
+            section, od1, od2, ch1, ch2 = self.segments[n]
+            candidate = {"section": section, "od": round(od1 + ((ch - ch1) * (od2 - od1)) / (ch2 - ch1))}
+            if candidate not in candidates:
+                candidates.append(candidate)
+        return candidates
+
+    def lookup_many(self, chs):
+        return [self.lookup(ch) for ch in chs]
+
+
+def section_origin(section):
+    # "SV-09 to SV-08" is measured from SV-09
+    return section.split(" to ")[0]
+
+def sections_from(direction):
+    """Sections whose OD is measured from `direction` (all of them when None)."""
+    if not direction:
+        return list(section_engines)
+    return [s for s in section_engines if s == direction or section_origin(s) == direction]
+
+
+chainage_index = ChainageIndex({})
+
+def interpolate_ch(engine, od):
+    return engine.ch_for_od(od)  # Always returns a list
+
+def interpolate_od(table, ch):
+    ods, chs = table["OD"], table["CH"]
+    for i in range(len(ods) - 1):
+        ch1 = chs[i]
+        ch2 = chs[i + 1]
+        od1 = ods[i]
+        od2 = ods[i + 1]
+        if ch1 <= ch <= ch2 and ch1 != ch2:
             interpolated = od1 + ((ch - ch1) * (od2 - od1)) / (ch2 - ch1)
             return round(interpolated)
     return None
 
 def get_linewalker_by_ch(ch):
-    for entry in linewalker_data:
-        if entry["start_ch"] <= ch <= entry["end_ch"]:
-            return entry["line_walker"]
-    return None
+    return linewalker_index.lookup(ch)
+
+def get_linewalkers_by_ch(chs):
+    return linewalker_index.lookup_many(chs)
 
 # ========== Main API ==========
 @app.get("/calculate_ch_for_section")
 def calculate_ch_for_section(section: str, od: float):
     print(f"[CH Lookup] Section={section}, OD={od}")
 
-    df = section_data.get(section)
-    if df is None:
+    engine = section_engines.get(section)
+    if engine is None:
         return {"error": f"Section '{section}' not found."}
 
-    ch_matches = interpolate_ch(df, od)
+    ch_matches = interpolate_ch(engine, od)
 
     if not ch_matches:
         return {"error": "OD out of range or no valid interpolation found."}
@@ -196,17 +1413,110 @@ def calculate_ch_for_section(section: str, od: float):
     }
 
 
+class ODQuery(BaseModel):
+    section: str
+    od: float
+
+@app.post("/calculate_ch_batch")
+def calculate_ch_batch(queries: list[ODQuery]):
+    print(f"[CH Batch] {len(queries)} lookups")
+
+    # Group by section so each section table is interpolated in one pass
+    by_section = {}
+    for pos, q in enumerate(queries):
+        by_section.setdefault(q.section, []).append(pos)
+
+    results = [None] * len(queries)
+    for section, positions in by_section.items():
+        engine = section_engines.get(section)
+        if engine is None:
+            for pos in positions:
+                results[pos] = {"section": section, "od": queries[pos].od, "error": f"Section '{section}' not found."}
+            continue
+
+        ch_lists = engine.ch_for_ods([queries[pos].od for pos in positions])
+        for pos, ch_matches in zip(positions, ch_lists):
+            item = {"section": section, "od": queries[pos].od}
+            if not ch_matches:
+                item["error"] = "OD out of range or no valid interpolation found."
+            else:
+                item["ch"] = ch_matches
+                item["line_walker"] = get_linewalkers_by_ch(ch_matches)
+            results[pos] = item
+
+    return results
+
+
 
 @app.get("/convert/ch-to-od")
 def convert_ch_to_od(section: str, ch: float):
-    df = section_data.get(section)
-    if df is None:
+    table = section_data.get(section)
+    if table is None:
         return {"error": f"Section '{section}' not found."}
-    od = interpolate_od(df, ch)
+    od = interpolate_od(table, ch)
     if od is None:
         return {"error": "CH out of range."}
     return {"od": od}
 
+# Section-less lookups: a CH from a field report, or an OD together with the
+# station the fibre is measured from, resolved against every section.
+class LocateQuery(BaseModel):
+    ch: Optional[float] = None
+    od: Optional[float] = None
+    direction: Optional[str] = None
+
+def locate_chs(chs):
+    return [
+        {"ch": ch, "candidates": candidates, "line_walker": get_linewalker_by_ch(ch)}
+        for ch, candidates in zip(chs, chainage_index.lookup_many(chs))
+    ]
+
+def locate_ods(ods, direction=None):
+    sections = sections_from(direction)
+    candidates = [[] for _ in ods]
+    for section in sections:
+        for i, ch_matches in enumerate(section_engines[section].ch_for_ods(ods)):
+            candidates[i].extend({"section": section, "ch": ch} for ch in ch_matches)
+    return [
+        {"od": od, "direction": direction, "candidates": found}
+        for od, found in zip(ods, candidates)
+    ]
+
+@app.get("/locate")
+def locate(ch: Optional[float] = None, od: Optional[float] = None, direction: Optional[str] = None):
+    if (ch is None) == (od is None):
+        return {"error": "Give exactly one of ch or od."}
+    if ch is not None:
+        return locate_chs([ch])[0]
+    if direction and not sections_from(direction):
+        return {"error": f"No section is measured from '{direction}'."}
+    return locate_ods([od], direction)[0]
+
+@app.post("/locate_batch")
+def locate_batch(queries: list[LocateQuery]):
+    print(f"[Locate Batch] {len(queries)} lookups")
+
+    results = [None] * len(queries)
+    ch_positions, od_positions = [], {}
+    for pos, q in enumerate(queries):
+        if (q.ch is None) == (q.od is None):
+            results[pos] = {"error": "Give exactly one of ch or od."}
+        elif q.ch is not None:
+            ch_positions.append(pos)
+        elif q.direction and not sections_from(q.direction):
+            results[pos] = {"od": q.od, "direction": q.direction, "error": f"No section is measured from '{q.direction}'."}
+        else:
+            od_positions.setdefault(q.direction or None, []).append(pos)
+
+    for pos, item in zip(ch_positions, locate_chs([queries[pos].ch for pos in ch_positions])):
+        results[pos] = item
+    # ODs sharing a direction are interpolated in one pass per section
+    for direction, positions in od_positions.items():
+        for pos, item in zip(positions, locate_ods([queries[pos].od for pos in positions], direction)):
+            results[pos] = item
+
+    return results
+
 class AlertPayload(BaseModel):
     od: float
     ch: float
@@ -214,7 +1524,7 @@ class AlertPayload(BaseModel):
     line_walker: str
 
 @app.post("/send_alert")
-def send_alert(payload: AlertPayload):
+def send_alert(payload: AlertPayload, wait: float = 0):
     msg = (
         "🔔 अलार्म सूचना 🔔\n"
         f"⏱️समय: {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}\n"
@@ -224,47 +1534,44 @@ def send_alert(payload: AlertPayload):
         f"🚶‍➡️लाइन वॉकर: {payload.line_walker}"
     )
 
-    url = f"https://api.telegram.org/bot{settings['BOT_TOKEN']}/sendMessage"
+    event = {
+        "OD": payload.od,
+        "CH": payload.ch,
+        "Section": payload.section,
+        "LineWalker": payload.line_walker,
+        "At": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
 
     try:
-        res = requests.post(url, json={"chat_id": settings['CHAT_ID'], "text": msg})
-        if res.status_code == 200:
-            # ✅ Log to SQLite
-            log_message_sqlite({
-                "OD": payload.od,
-                "CH": payload.ch,
-                "Section": payload.section,
-                "LineWalker": payload.line_walker
-            })
-            return {
-                "status": "success",
-                "message_id": res.json().get("result", {}).get("message_id", None)
-            }
-        else:
-            return {
-                "status": "error",
-                "detail": f"Telegram API returned {res.status_code}: {res.text}"
-            }
-
+        # 🔁 Alarms close to one already sent are held and summarised later;
+        # joining a group logs the alarm and updates the held summary
+        group = alarm_coalescer.offer(event)
+        if group is not None:
+            return {"status": "coalesced", "group_id": group["id"], "alert_id": group["alert_id"], "count": len(group["events"]) + 1}
+
+        # ✅ Persist to the outbox first, one row per routed chat; the dispatcher
+        # sends them concurrently and logs the alarm to sent_logs once
+        alert_id = enqueue_alert(resolve_destinations(payload.section, payload.ch), msg, event)[0]
     except Exception as e:
         return {
             "status": "error",
-            "detail": f"Exception while sending alert: {str(e)}"
+            "detail": f"Exception while queueing alert: {str(e)}"
         }
 
+    # Optionally hold the request until Telegram answers every chat (old blocking behaviour)
+    if wait > 0:
+        return alert_delivery_response(outbox_dispatcher.wait_for(alert_id, wait))
+    return alert_delivery_response(get_alert_rows(alert_id))
+
 @app.get("/receive")
 def get_received_logs(limit: int = 100):
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("""
+        rows = get_db().execute("""
             SELECT timestamp, linewalker, message, user 
             FROM received_messages 
             ORDER BY timestamp DESC 
             LIMIT ?
-        """, (limit,))
-        rows = c.fetchall()
-        conn.close()
+        """, (limit,)).fetchall()
 
         return [
             {
@@ -281,7 +1588,7 @@ def get_received_logs(limit: int = 100):
 
 # ========== Logging ==========
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
 
     # Table: Sent Logs
@@ -308,6 +1615,40 @@ def init_db():
         )
     ''')
 
+    # Table: Outbox of alerts waiting for (or done with) Telegram delivery
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT,
+            chat_id TEXT,
+            text TEXT,
+            payload TEXT,
+            status TEXT,
+            attempts INTEGER,
+            next_attempt_at REAL,
+            message_id INTEGER,
+            last_error TEXT,
+            sent_at TEXT
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (status, next_attempt_at)")
+
+    # Table: Per-shift alarm counts, derived from sent_logs
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS shift_counts (
+            shift TEXT,
+            dimension TEXT,
+            key TEXT,
+            count INTEGER,
+            PRIMARY KEY (shift, dimension, key)
+        )
+    ''')
+
+    # Table: Alarm counts by CH bin, section and hour, per day and per month
+    c.execute(f'''
+        CREATE TABLE IF NOT EXISTS hotspot_cells ({HOTSPOT_CELLS_COLUMNS})
+    ''')
+
     # Table: Duty Status with separate columns for ON and OFF messages
     c.execute('''
         CREATE TABLE IF NOT EXISTS duty_status (
@@ -319,33 +1660,316 @@ def init_db():
         )
     ''')
 
+    # Table: Versioned settings, line walkers and section tables shared by all workers
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS shared_state (
+            key TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            value TEXT NOT NULL,
+            updated_at TEXT
+        )
+    ''')
+
+    # Table: Leases for background roles that only one worker may run
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT,
+            expires_at REAL
+        )
+    ''')
+
+    # Table: update_ids already stored, shared by every worker for deduplication
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id INTEGER PRIMARY KEY,
+            processed_at REAL
+        )
+    ''')
+
+    # Table: Next getUpdates offset per bot, for polling mode
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS update_offsets (
+            bot TEXT PRIMARY KEY,
+            next_offset INTEGER,
+            updated_at TEXT
+        )
+    ''')
+
     conn.commit()
-    conn.close()
+    migrate_db(conn)
+
+def backfill_sent_log_epochs(conn):
+    # Local-time epochs, matching how new rows are stamped in sent_log_row
+    rows = conn.execute("SELECT id, date, time, ch FROM sent_logs").fetchall()
+    updates = []
+    for row_id, date, time_str, ch in rows:
+        try:
+            ts = int(datetime.strptime(f"{date} {time_str}", "%Y-%m-%d %H:%M:%S").timestamp())
+        except (TypeError, ValueError):
+            ts = None
+        updates.append((ts, to_float_or_none(ch), row_id))
+    conn.executemany("UPDATE sent_logs SET ts = ?, ch_num = ? WHERE id = ?", updates)
+
+# Schema changes applied once each, in order, and tracked in PRAGMA
+# user_version. A step is either an SQL string or a function taking the
+# connection. Each migration's steps and its user_version bump run in one
+# explicit transaction (sqlite3 would otherwise autocommit the DDL), so a
+# failed step leaves no half-applied schema behind. That transaction takes the
+# write lock before it reads user_version, so workers starting together apply
+# each migration once: the others wait and then find it done. VACUUM cannot
+# run inside a transaction and runs right after its migration commits.
+DB_MIGRATION_LOCK_TIMEOUT = 600  # seconds a starting worker waits for another one's migration
+DB_MIGRATIONS = [
+    # 1: indexes for time-range, section and line walker queries
+    [
+        "CREATE INDEX IF NOT EXISTS idx_received_timestamp ON received_messages (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_received_linewalker ON received_messages (linewalker, id)",
+        "CREATE INDEX IF NOT EXISTS idx_duty_timestamp ON duty_status (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_duty_linewalker ON duty_status (linewalker, id)",
+        "CREATE INDEX IF NOT EXISTS idx_sent_date_time ON sent_logs (date, time)",
+        "CREATE INDEX IF NOT EXISTS idx_sent_section ON sent_logs (section, id)",
+        "CREATE INDEX IF NOT EXISTS idx_sent_linewalker ON sent_logs (linewalker, id)",
+    ],
+    # 2: typed epoch time and numeric CH on sent_logs, so shift filters run in SQL
+    [
+        "ALTER TABLE sent_logs ADD COLUMN ts INTEGER",
+        "ALTER TABLE sent_logs ADD COLUMN ch_num REAL",
+        backfill_sent_log_epochs,
+        "CREATE INDEX IF NOT EXISTS idx_sent_ts ON sent_logs (ts)",
+    ],
+    # 3: incremental auto-vacuum, so pages freed by archiving can be released
+    [
+        "PRAGMA auto_vacuum = INCREMENTAL",
+        "VACUUM",
+    ],
+    # 4: outbox rows fanned out from one alert share its alert_id
+    [
+        "ALTER TABLE outbox ADD COLUMN alert_id INTEGER",
+        "UPDATE outbox SET alert_id = id",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_alert ON outbox (alert_id)",
+    ],
+    # 5: hotspot cells for the alarms logged so far, archived months included
+    [
+        lambda conn: rebuild_hotspot_cells(conn, HOTSPOT_DEFAULTS["bin_km"]),
+    ],
+]
+
+def migrate_db(conn):
+    busy_timeout = conn.execute("PRAGMA busy_timeout").fetchone()[0]
+    conn.execute(f"PRAGMA busy_timeout = {DB_MIGRATION_LOCK_TIMEOUT * 1000}")
+    try:
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                number = conn.execute("PRAGMA user_version").fetchone()[0] + 1
+                if number > len(DB_MIGRATIONS):
+                    conn.rollback()
+                    return
+                steps = DB_MIGRATIONS[number - 1]
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    elif step != "VACUUM":
+                        conn.execute(step)
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            if "VACUUM" in steps:
+                try:
+                    conn.execute("VACUUM")
+                except sqlite3.OperationalError as e:
+                    # Only delays reclaiming space; the schema itself is migrated
+                    print(f"[DB Error] VACUUM after migration {number} failed: {e}")
+            print(f"[DB] Applied migration {number}")
+    finally:
+        conn.execute(f"PRAGMA busy_timeout = {busy_timeout}")
+
+
+
+# ========== Webhook Ingestion ==========
+# Webhook updates are parsed inline and their rows handed to one writer
+# thread, which drains whatever has queued up and commits it as a single
+# transaction. The request waits for that commit: a failed batch is retried
+# with backoff, and only if it still fails does /webhook answer 500, so
+# Telegram delivers the update again. Telegram also re-delivers updates it
+# believes failed, and a retry may land on another worker, so each update_id
+# is recorded in processed_updates in the transaction that stores its rows;
+# an update whose id is already there is dropped, whichever worker took it.
+WEBHOOK_BATCH_MAX = 500
+WEBHOOK_BATCH_WAIT = 0.05  # seconds to let a burst accumulate before committing
+WEBHOOK_DEDUP_HOURS = 48  # Telegram gives up re-delivering an update after 24 hours
+WEBHOOK_COMMIT_ATTEMPTS = 4
+WEBHOOK_RETRY_WAIT = 0.25  # doubled after every failed attempt
+
+WEBHOOK_INSERTS = {
+    "duty_status": '''
+        INSERT INTO duty_status (timestamp, linewalker, duty_on, duty_off)
+        VALUES (?, ?, ?, ?)
+    ''',
+    "received_messages": '''
+        INSERT INTO received_messages (timestamp, linewalker, message, user)
+        VALUES (?, ?, ?, ?)
+    ''',
+    # Polling mode: committed with the rows of the updates it acknowledges
+    "update_offsets": '''
+        INSERT INTO update_offsets (bot, next_offset, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(bot) DO UPDATE SET
+            next_offset = MAX(next_offset, excluded.next_offset), updated_at = excluded.updated_at
+    '''
+}
 
-init_db()
 
+class WebhookWriter:
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+        self.stats = {
+            "batches": 0,
+            "rows": 0,
+            "duplicates": 0,
+            "errors": 0,
+            "last_batch_size": 0,
+            "last_commit_ms": 0.0,
+            "max_commit_ms": 0.0,
+            "avg_commit_ms": 0.0
+        }
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run, name="webhook-writer", daemon=True)
+            self.thread.start()
+
+    def submit(self, updates):
+        """Queue [(update_id, [(table, row), ...]), ...] to be committed together.
+
+        The Future resolves once they are, to the set of update_ids that had
+        already been processed and were skipped. An update_id of None is
+        never treated as a duplicate.
+        """
+        future = Future()
+        self.queue.put((updates, future))
+        return future
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + WEBHOOK_BATCH_WAIT
+            while len(batch) < WEBHOOK_BATCH_MAX:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.commit(batch)
+
+    def commit(self, batch):
+        for attempt in range(1, WEBHOOK_COMMIT_ATTEMPTS + 1):
+            try:
+                skipped = self.write(batch)
+                break
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"[Log Error] Attempt {attempt} to commit {len(batch)} webhook updates failed: {e}")
+            if attempt < WEBHOOK_COMMIT_ATTEMPTS:
+                time.sleep(WEBHOOK_RETRY_WAIT * 2 ** (attempt - 1))
+        else:
+            # One bad update must not take the rest of the batch down with it
+            for entry in batch:
+                try:
+                    skipped = self.write([entry])
+                except Exception as e:
+                    entry[1].set_exception(e)
+                else:
+                    entry[1].set_result(skipped[0])
+            return
+        for (_updates, future), duplicates in zip(batch, skipped):
+            future.set_result(duplicates)
+
+    def write(self, batch):
+        """Commit a batch in one transaction; returns the skipped update_ids per entry."""
+        now = time.time()
+        skipped = []
+        rows_by_table = {}
+        started = time.perf_counter()
+        with db_transaction() as conn:
+            for updates, _future in batch:
+                duplicates = set()
+                for update_id, rows in updates:
+                    if update_id is not None and not conn.execute(
+                        "INSERT OR IGNORE INTO processed_updates (update_id, processed_at) VALUES (?, ?)", (update_id, now)
+                    ).rowcount:
+                        duplicates.add(update_id)
+                        continue
+                    for table, row in rows:
+                        rows_by_table.setdefault(table, []).append(row)
+                skipped.append(duplicates)
+            for table, rows in rows_by_table.items():
+                conn.executemany(WEBHOOK_INSERTS[table], rows)
+            if self.stats["batches"] % 1000 == 0:
+                conn.execute("DELETE FROM processed_updates WHERE processed_at < ?", (now - WEBHOOK_DEDUP_HOURS * 3600,))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        live_feed.notify()
+
+        count = sum(len(rows) for rows in rows_by_table.values())
+        stats = self.stats
+        stats["batches"] += 1
+        stats["rows"] += count
+        WEBHOOK_ROWS_COMMITTED.inc(amount=count)
+        stats["duplicates"] += sum(len(duplicates) for duplicates in skipped)
+        stats["last_batch_size"] = count
+        stats["last_commit_ms"] = round(elapsed_ms, 3)
+        stats["max_commit_ms"] = round(max(stats["max_commit_ms"], elapsed_ms), 3)
+        stats["avg_commit_ms"] = round(stats["avg_commit_ms"] + (elapsed_ms - stats["avg_commit_ms"]) / stats["batches"], 3)
+        if count:
+            print(f"[LOG] Committed {count} webhook rows ({', '.join(f'{t}: {len(r)}' for t, r in rows_by_table.items())})")
+        return skipped
+
+    def snapshot(self):
+        return {"queue_depth": self.queue.qsize(), **self.stats}
+
+
+webhook_writer = WebhookWriter()
 
 @app.post("/webhook")
-async def webhook(request: Request, background_tasks: BackgroundTasks):
+async def webhook(request: Request):
     data = await request.json()
-    background_tasks.add_task(handle_webhook, data)
+    try:
+        duplicates = await asyncio.wrap_future(handle_webhook(data))
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"status": "error", "detail": str(e)})
+    if data.get("update_id") in duplicates:
+        return {"status": "duplicate"}
     return {"status": "received"}
 
+@app.get("/webhook_stats")
+def webhook_stats():
+    return webhook_writer.snapshot()
+
 def handle_webhook(data):
+    """Queue the update's rows; returns the writer's Future for their commit."""
+    return webhook_writer.submit([(data.get("update_id"), webhook_rows(data))])
+
+def webhook_rows(data):
     try:
         msg = data.get("message", {})
         text = msg.get("text", "").strip()
         user = msg.get("from", {}).get("first_name", "Unknown")
 
         if text:
-            log_duty_status_from_message(user, text, user)
+            return [duty_status_row_from_message(user, text, user)]
 
     except Exception as e:
         print("Webhook error:", e)
+    return []
 
 
 
-def log_duty_status_from_message(linewalker, message, user):
+def duty_status_row_from_message(linewalker, message, user):
     msg_lower = message.lower()
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
@@ -353,226 +1977,1762 @@ def log_duty_status_from_message(linewalker, message, user):
     duty_off_msg = message if "off" in msg_lower else None
 
     if duty_on_msg or duty_off_msg:
-        try:
-            conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute('''
-                INSERT INTO duty_status (timestamp, linewalker, duty_on, duty_off)
-                VALUES (?, ?, ?, ?)
-            ''', (timestamp, linewalker, duty_on_msg, duty_off_msg))
-            conn.commit()
-            print(f"[LOG] Duty status logged for {linewalker}")
-        except Exception as e:
-            print(f"[Log Error] Failed to log duty status: {e}")
-        finally:
-            conn.close()
-    else:
-        log_received_message(linewalker, message, user)
+        return "duty_status", (timestamp, linewalker, duty_on_msg, duty_off_msg)
+    return received_message_row(linewalker, message, user)
 
 
-def log_received_message(linewalker, message, user):
+def received_message_row(linewalker, message, user):
     now = datetime.now()
+    return "received_messages", (
+        now.strftime("%Y-%m-%d %H:%M:%S"),
+        linewalker,
+        message,
+        user
+    )
+
+
+# ========== Update Polling ==========
+# Where Telegram cannot reach /webhook (a local or air-gapped deployment),
+# updates are pulled with getUpdates instead. The worker holding the
+# "polling" lease long-polls for batches and hands each batch's rows,
+# together with the next offset, to the webhook writer as one entry, so they
+# are committed in the same transaction. The offset in memory only moves on
+# once that commit succeeds; if it fails, the batch is fetched again and a
+# restart resumes exactly where the database left off.
+POLLING_DEFAULTS = {"enabled": False, "timeout": 30, "limit": 100}
+POLLING_ERROR_WAIT = 5.0
+
+def polling_config():
+    return {**POLLING_DEFAULTS, **settings.get("POLLING", {})}
+
+def bot_id():
+    # Offsets belong to a bot; a new token starts from its own
+    return str(settings.get("BOT_TOKEN", "")).split(":")[0]
+
+def read_update_offset():
+    row = get_db().execute("SELECT next_offset FROM update_offsets WHERE bot = ?", (bot_id(),)).fetchone()
+    return row[0] if row else None
+
+
+class UpdatePoller:
+    def __init__(self):
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.active = False  # polling under the lease, webhook removed, offset loaded
+        self.offset = None  # next update_id to ask for
+        self.stats = {"polls": 0, "updates": 0, "duplicates": 0, "errors": 0, "last_poll_at": None, "last_error": None}
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name="update-poller", daemon=True)
+            self.thread.start()
+
+    def notify(self):
+        self.wakeup.set()
+
+    def stop(self, timeout=1.0):
+        # A long poll in flight is abandoned; its updates are fetched again next time
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        while not self.stopping.is_set():
+            wait = 0.0
+            try:
+                sync_shared_state()  # polling may have been switched on in another worker
+                config = polling_config()
+                if config["enabled"] and hold_lease("polling"):
+                    if not self.active:
+                        self.begin()
+                    self.poll(config)
+                else:
+                    self.active = False
+                    wait = LEASE_TTL / 4
+            except Exception as e:
+                self.active = False
+                self.stats["errors"] += 1
+                self.stats["last_error"] = str(e)
+                print(f"[Polling Error] {e}")
+                wait = POLLING_ERROR_WAIT
+            if wait and self.wakeup.wait(wait):
+                self.wakeup.clear()
+
+    def begin(self):
+        # Telegram refuses getUpdates while a webhook is set
+        res = telegram_request("POST", "deleteWebhook")
+        if res.status_code != 200:
+            raise RuntimeError(f"deleteWebhook returned {res.status_code}: {res.text}")
+        self.offset = read_update_offset()
+        self.active = True
+        print(f"[Polling] Polling for updates from offset {self.offset}")
+
+    def poll(self, config):
+        global last_update_id
+        params = {"timeout": int(config["timeout"]), "limit": int(config["limit"]), "allowed_updates": ["message"]}
+        if self.offset is not None:
+            params["offset"] = self.offset  # also confirms everything before it to Telegram
+        read_timeout = TELEGRAM_TIMEOUT[1] + params["timeout"]
+        res = telegram_request("POST", "getUpdates", timeout=(TELEGRAM_TIMEOUT[0], read_timeout), json=params)
+        if res.status_code != 200:
+            raise RuntimeError(f"getUpdates returned {res.status_code}: {res.text}")
+        if self.stopping.is_set():
+            return
+
+        updates = res.json().get("result", [])
+        self.stats["polls"] += 1
+        self.stats["last_poll_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if not updates:
+            return
+        newest = max(update["update_id"] for update in updates)
+        entry = [(update.get("update_id"), webhook_rows(update)) for update in updates]
+        entry.append((None, [("update_offsets", (bot_id(), newest + 1, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))]))
+        duplicates = webhook_writer.submit(entry).result()  # raises if the batch could not be stored
+        self.stats["duplicates"] += len(duplicates)
+        last_update_id = newest
+        self.offset = newest + 1
+        self.stats["updates"] += len(updates)
+
+    def snapshot(self):
+        return {"active": self.active, "offset": self.offset, "last_update_id": last_update_id, **self.stats}
+
+
+update_poller = UpdatePoller()
+
+class PollingConfig(BaseModel):
+    enabled: bool
+    timeout: int = POLLING_DEFAULTS["timeout"]
+    limit: int = POLLING_DEFAULTS["limit"]
+
+@app.get("/polling")
+def get_polling():
+    return {**polling_config(), **update_poller.snapshot()}
+
+@app.post("/polling")
+def update_polling(data: PollingConfig, auth=Depends(verify_api_key)):
+    if not 1 <= data.timeout <= 50:
+        raise HTTPException(status_code=400, detail="timeout must be between 1 and 50 seconds")
+    if not 1 <= data.limit <= 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO received_messages (timestamp, linewalker, message, user)
-            VALUES (?, ?, ?, ?)
-        ''', (
-            now.strftime("%Y-%m-%d %H:%M:%S"),
-            linewalker,
-            message,
-            user
-        ))
-        conn.commit()
-        print(f"[✓] Logged general message from {linewalker}")
+        config = {**settings, "POLLING": data.dict()}
+        save_settings(config)
+        update_poller.notify()
+        return {"status": "success", **polling_config()}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"status": "error", "detail": str(e)})
+
+
+# ========== Scheduler ==========
+# One asyncio task owns every timed job. Jobs sit in a heap keyed by their
+# exact wall-clock deadline, the task sleeps until the earliest one, and the
+# job body runs in a worker thread. Scheduling a job under an existing key
+# replaces it. A deadline that passed while the service was down is simply
+# due at startup, so missed jobs catch up on the first pass.
+SCHEDULER_MAX_SLEEP = 60.0  # re-check the wall clock at least this often
+
+
+class Scheduler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.heap = []  # (when, seq, key); stale entries are skipped
+        self.jobs = {}  # key -> (when, seq, func)
+        self.seq = itertools.count()
+        self.loop = None
+        self.wakeup = None
+        self.task = None
+
+    def schedule(self, key, when, func):
+        """Run func() in a worker thread at epoch time `when`."""
+        with self.lock:
+            seq = next(self.seq)
+            self.jobs[key] = (when, seq, func)
+            heapq.heappush(self.heap, (when, seq, key))
+        self.wake()
+
+    def cancel(self, key):
+        with self.lock:
+            self.jobs.pop(key, None)
+
+    def keys(self, prefix=""):
+        with self.lock:
+            return [key for key in self.jobs if key.startswith(prefix)]
+
+    def wake(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def upcoming(self):
+        now = time.time()
+        with self.lock:
+            jobs = sorted((when, key) for key, (when, _seq, _func) in self.jobs.items())
+        return [
+            {
+                "job": key,
+                "due": datetime.fromtimestamp(when).strftime("%Y-%m-%d %H:%M:%S"),
+                "in_seconds": round(max(when - now, 0), 1)
+            }
+            for when, key in jobs
+        ]
+
+    def pop_due(self, now):
+        due = []
+        with self.lock:
+            while self.heap:
+                when, seq, key = self.heap[0]
+                job = self.jobs.get(key)
+                if job is None or job[1] != seq:
+                    heapq.heappop(self.heap)  # cancelled or rescheduled
+                    continue
+                if when > now:
+                    return due, when
+                heapq.heappop(self.heap)
+                del self.jobs[key]
+                due.append((key, job[2]))
+        return due, None
+
+    async def run(self):
+        while True:
+            due, next_when = self.pop_due(time.time())
+            for key, func in due:
+                try:
+                    await asyncio.to_thread(func)
+                except Exception as e:
+                    print(f"[Scheduler Error] {key}: {e}")
+            if due:
+                continue
+
+            timeout = SCHEDULER_MAX_SLEEP
+            if next_when is not None:
+                timeout = min(max(next_when - time.time(), 0.0), SCHEDULER_MAX_SLEEP)
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.task = self.loop.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+
+scheduler = Scheduler()
+
+def schedule_duty_reset():
+    # Always queue the reset for the most recent 06:30 first: it only deletes
+    # rows older than that boundary, so it is a no-op unless one was missed.
+    boundary = current_shift_window()[0]
+    scheduler.schedule("duty_reset", time.time(), lambda: clear_duty_status(boundary))
+
+def clear_duty_status(boundary):
+    try:
+        with db_transaction() as conn:
+            cleared = conn.execute(
+                "DELETE FROM duty_status WHERE timestamp < ?",
+                (boundary.strftime("%Y-%m-%d %H:%M:%S"),)
+            ).rowcount
+        if cleared:
+            print(f"[✓] Duty_Status auto-cleared at 06:30 on {boundary.strftime('%Y-%m-%d')} ({cleared} rows)")
+    except Exception as e:
+        print(f"[!] Error clearing Duty_Status: {e}")
+
+    next_boundary = boundary + timedelta(days=1)
+    while next_boundary.timestamp() <= time.time():
+        next_boundary += timedelta(days=1)
+    scheduler.schedule("duty_reset", next_boundary.timestamp(), lambda: clear_duty_status(next_boundary))
+
+@app.get("/scheduler/jobs")
+def scheduler_jobs():
+    return scheduler.upcoming()
+
+
+# ========== Telegram Outbox ==========
+# Alerts are written to the outbox table before anything touches the network,
+# one row per destination chat. A single background dispatcher drains it over
+# a pooled keep-alive session, sending to different chats concurrently, pacing
+# each chat to Telegram's flood limits and retrying with backoff, so a slow or
+# failed Telegram call never blocks a request, another chat, or loses an alarm.
+# Once Telegram has accepted a message it is never sent again: if recording
+# the delivery fails, the dispatcher keeps it and retries the bookkeeping
+# alone before its next round of sends.
+TELEGRAM_API_BASE = os.environ.get("TELEGRAM_API_BASE", "https://api.telegram.org")
+TELEGRAM_TIMEOUT = (5, 15)  # connect, read (seconds)
+TELEGRAM_GLOBAL_INTERVAL = 1 / 30  # 30 messages/second per bot
+TELEGRAM_CHAT_INTERVAL = 1.0  # 1 message/second per private chat
+TELEGRAM_GROUP_INTERVAL = 3.0  # 20 messages/minute per group
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BACKOFF_BASE = 2.0
+OUTBOX_BACKOFF_MAX = 300.0
+OUTBOX_BATCH = 100
+OUTBOX_IDLE_WAIT = 30.0
+OUTBOX_POLL_INTERVAL = 0.5  # how often an idle dispatcher looks for commits from other workers
+OUTBOX_SEND_WORKERS = 8  # chats sent to at the same time; stays below the session's pool_maxsize
+# Telegram answers these for requests that will never succeed as-is
+TELEGRAM_PERMANENT_ERRORS = {400, 403, 404}
+
+telegram_session = None
+telegram_session_lock = threading.Lock()
+
+def get_telegram_session():
+    global telegram_session
+    with telegram_session_lock:
+        if telegram_session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            telegram_session = session
+        return telegram_session
+
+def telegram_api_url(method):
+    return f"{TELEGRAM_API_BASE}/bot{settings['BOT_TOKEN']}/{method}"
+
+def telegram_request(http_method, method, timeout=TELEGRAM_TIMEOUT, **kwargs):
+    """Call the Bot API, recording latency and errors for /metrics."""
+    started = time.perf_counter()
+    try:
+        res = get_telegram_session().request(http_method, telegram_api_url(method), timeout=timeout, **kwargs)
     except Exception as e:
-        print(f"[Log Error] Failed to log received message: {e}")
+        TELEGRAM_ERRORS.inc(method, type(e).__name__)
+        raise
     finally:
-        conn.close()
+        TELEGRAM_REQUEST_SECONDS.observe(time.perf_counter() - started, method)
+    if res.status_code != 200:
+        TELEGRAM_ERRORS.inc(method, str(res.status_code))
+    return res
+
+def chat_send_interval(chat_id):
+    # Group and channel IDs are negative
+    return TELEGRAM_GROUP_INTERVAL if str(chat_id).startswith("-") else TELEGRAM_CHAT_INTERVAL
+
+def insert_outbox_rows(conn, chat_ids, text, payload, status="pending", send_at=None, alert_id=None):
+    """Add one row per chat, all sharing alert_id (the first new id unless given); return their ids."""
+    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    payload = json.dumps(payload, ensure_ascii=False) if payload is not None else None
+    outbox_ids = []
+    for chat_id in chat_ids:
+        cur = conn.execute('''
+            INSERT INTO outbox (created_at, chat_id, text, payload, status, attempts, next_attempt_at, alert_id)
+            VALUES (?, ?, ?, ?, ?, 0, ?, ?)
+        ''', (created_at, str(chat_id), text, payload, status, send_at or time.time(), alert_id))
+        outbox_ids.append(cur.lastrowid)
+        if alert_id is None:
+            alert_id = cur.lastrowid
+            conn.execute("UPDATE outbox SET alert_id = ? WHERE id = ?", (alert_id, alert_id))
+    return outbox_ids
+
+def enqueue_alert(chat_ids, text, payload):
+    """Queue one message per destination chat; return their outbox ids, first one is the alert_id."""
+    with db_transaction() as conn:
+        outbox_ids = insert_outbox_rows(conn, chat_ids, text, payload)
+    outbox_dispatcher.notify()
+    return outbox_ids
+
+OUTBOX_ROW_COLUMNS = "id, alert_id, chat_id, status, attempts, message_id, last_error, sent_at"
+
+def outbox_row_dict(row):
+    return {
+        "outbox_id": row[0],
+        "alert_id": row[1],
+        "chat_id": row[2],
+        "status": row[3],
+        "attempts": row[4],
+        "message_id": row[5],
+        "last_error": row[6],
+        "sent_at": row[7]
+    }
+
+def get_outbox_row(outbox_id):
+    row = get_db().execute(f"SELECT {OUTBOX_ROW_COLUMNS} FROM outbox WHERE id = ?", (outbox_id,)).fetchone()
+    return outbox_row_dict(row) if row is not None else None
+
+def get_alert_rows(alert_id):
+    rows = get_db().execute(
+        f"SELECT {OUTBOX_ROW_COLUMNS} FROM outbox WHERE alert_id = ? ORDER BY id", (alert_id,)
+    ).fetchall()
+    return [outbox_row_dict(row) for row in rows]
+
+def alert_status_response(row):
+    if row is None:
+        return {"status": "error", "detail": "Alert not found in outbox."}
+    if row["status"] == "sent":
+        return {"status": "success", "outbox_id": row["outbox_id"], "message_id": row["message_id"]}
+    if row["status"] == "failed":
+        return {"status": "error", "outbox_id": row["outbox_id"], "detail": row["last_error"]}
+    return {"status": "queued", "outbox_id": row["outbox_id"], "message_id": None, "attempts": row["attempts"]}
+
+def alert_delivery_response(rows):
+    """Per-destination results of one alert, plus an overall status for older clients."""
+    if not rows:
+        return alert_status_response(None)
+    destinations = [{"chat_id": row["chat_id"], **alert_status_response(row)} for row in rows]
+    statuses = {d["status"] for d in destinations}
+    if statuses == {"success"}:
+        status = "success"
+    elif "queued" in statuses:
+        status = "queued"
+    elif statuses == {"error"}:
+        status = "error"
+    else:
+        status = "partial"
+    response = {**destinations[0], "status": status, "alert_id": rows[0]["alert_id"], "destinations": destinations}
+    response.pop("chat_id")
+    return response
+
+
+class OutboxDispatcher:
+    def __init__(self):
+        self.wakeup = threading.Event()
+        self.delivered = threading.Condition()
+        self.chat_ready_at = {}  # chat_id -> monotonic time of next allowed send
+        self.unrecorded = {}  # outbox_id -> delivery Telegram accepted but the database has not recorded yet
+        self.global_ready_at = 0.0
+        self.senders = ThreadPoolExecutor(max_workers=OUTBOX_SEND_WORKERS, thread_name_prefix="outbox-send")
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name="outbox-dispatcher", daemon=True)
+            self.thread.start()
+
+    def notify(self):
+        self.wakeup.set()
+
+    def stop(self, timeout=5.0):
+        """Finish the sends in flight and stop, so the outbox lease can be released."""
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def wait_for(self, alert_id, timeout):
+        """Wait until every destination of the alert is sent or failed; return their rows."""
+        deadline = time.monotonic() + timeout
+        with self.delivered:
+            while True:
+                rows = get_alert_rows(alert_id)
+                remaining = deadline - time.monotonic()
+                if all(row["status"] not in ("pending", "held") for row in rows) or remaining <= 0:
+                    return rows
+                # Another worker may be the one delivering it, so re-check
+                self.delivered.wait(min(remaining, OUTBOX_POLL_INTERVAL))
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                # Only the worker holding the lease sends, so rate limits hold
+                if hold_lease("outbox"):
+                    wait = self.dispatch_due()
+                else:
+                    wait = LEASE_TTL / 4
+            except Exception as e:
+                print(f"[Outbox Error] {e}")
+                wait = 5.0
+            self.idle(wait)
+
+    def idle(self, wait):
+        """Sleep until notified, until `wait` passes, or until another connection commits."""
+        conn = get_db()
+        version = data_version(conn)
+        deadline = time.monotonic() + wait
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self.wakeup.wait(min(remaining, OUTBOX_POLL_INTERVAL)):
+                break
+            if data_version(conn) != version:
+                break  # e.g. another worker queued an alert
+        self.wakeup.clear()
+
+    def dispatch_due(self):
+        """Send every due message the rate limits allow; return seconds until the next one."""
+        for delivery in list(self.unrecorded.values()):
+            self.record_sent(delivery)  # raises while the database still refuses, so nothing is re-sent
+            del self.unrecorded[delivery["outbox_id"]]
+        with db_transaction() as conn:
+            # Coalesced summaries whose window has closed
+            conn.execute("UPDATE outbox SET status = 'pending' WHERE status = 'held' AND next_attempt_at <= ?", (time.time(),))
+        rows = get_db().execute('''
+            SELECT id, chat_id, text, payload, created_at, attempts, alert_id
+            FROM outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY id
+            LIMIT ?
+        ''', (time.time(), OUTBOX_BATCH)).fetchall()
+
+        sync_shared_state()  # the bot token may have changed in another worker
+        blocked = set()
+        sending = {}  # chat_id -> future; one message per chat per round
+        for row in rows:
+            if self.stopping.is_set() or (sending and not hold_lease("outbox")):
+                break
+            chat_id = row[1]
+            if chat_id in blocked:
+                continue  # keep per-chat order: nothing overtakes a throttled message
+            if chat_id in sending:
+                continue  # next in line once the current one is answered
+            now = time.monotonic()
+            if self.chat_ready_at.get(chat_id, 0.0) > now:
+                blocked.add(chat_id)
+                continue
+            if self.global_ready_at > now:
+                time.sleep(self.global_ready_at - now)
+            self.global_ready_at = time.monotonic() + TELEGRAM_GLOBAL_INTERVAL
+            # Different chats go out together, so a fan-out takes as long as its slowest chat
+            sending[chat_id] = self.senders.submit(self.send, row)
+        for future in sending.values():
+            future.result()
+
+        if len(rows) == OUTBOX_BATCH and not blocked:
+            return 0.0
+        return self.next_wakeup()
+
+    def next_wakeup(self):
+        """Seconds until some chat has a message that is both due and allowed by its pacing."""
+        now, monotonic_now = time.time(), time.monotonic()
+        wait = OUTBOX_IDLE_WAIT
+        rows = get_db().execute(
+            "SELECT chat_id, MIN(next_attempt_at) FROM outbox WHERE status IN ('pending', 'held') GROUP BY chat_id"
+        ).fetchall()
+        for chat_id, next_due in rows:
+            ready_in = max(next_due - now, self.chat_ready_at.get(chat_id, 0.0) - monotonic_now)
+            wait = min(wait, max(ready_in, 0.0))
+        return wait
+
+    def send(self, row):
+        outbox_id, chat_id, text, payload, created_at, attempts, alert_id = row
+        attempts += 1
+        self.chat_ready_at[chat_id] = time.monotonic() + chat_send_interval(chat_id)
 
+        try:
+            res = telegram_request("POST", "sendMessage", json={"chat_id": chat_id, "text": text})
+        except OSError as e:  # requests.RequestException and socket errors
+            self.retry(outbox_id, attempts, f"Exception while sending alert: {e}")
+            return
 
-def clear_duty_status_if_due():
-    last_cleared_date = None
-    while True:
-        now = datetime.now()
-        if now.strftime("%H:%M") == "06:30" and last_cleared_date != now.strftime("%Y-%m-%d"):
+        if res.status_code == 200:
             try:
-                conn = sqlite3.connect(DB_FILE)
-                c = conn.cursor()
-                c.execute("DELETE FROM duty_status")
-                conn.commit()
-                conn.close()
-                print(f"[✓] Duty_Status auto-cleared at 06:30 on {now.strftime('%Y-%m-%d')}")
-                last_cleared_date = now.strftime("%Y-%m-%d")
+                message_id = res.json().get("result", {}).get("message_id")
+            except (ValueError, AttributeError):
+                message_id = None  # delivered all the same
+            delivery = {
+                "outbox_id": outbox_id, "alert_id": alert_id, "attempts": attempts, "message_id": message_id,
+                "sent_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "payload": payload, "created_at": created_at
+            }
+            try:
+                self.record_sent(delivery)
             except Exception as e:
-                print(f"[!] Error clearing Duty_Status: {e}")
-        time.sleep(60)
+                self.unrecorded[outbox_id] = delivery
+                print(f"[Outbox Error] Alert {outbox_id} was delivered but not recorded, will record it again: {e}")
+            return
 
+        detail = f"Telegram API returned {res.status_code}: {res.text}"
+        if res.status_code == 429:
+            # Flood control: Telegram tells us exactly how long to back off
+            try:
+                retry_after = float(res.json().get("parameters", {}).get("retry_after", 0))
+            except ValueError:
+                retry_after = 0
+            self.chat_ready_at[chat_id] = time.monotonic() + retry_after
+            self.retry(outbox_id, attempts, detail, retry_after)
+        elif res.status_code in TELEGRAM_PERMANENT_ERRORS:
+            self.fail(outbox_id, attempts, detail)
+        else:
+            self.retry(outbox_id, attempts, detail)
+
+    def record_sent(self, delivery):
+        outbox_id, alert_id = delivery["outbox_id"], delivery["alert_id"]
+        with db_transaction() as conn:
+            conn.execute('''
+                UPDATE outbox SET status = 'sent', attempts = ?, message_id = ?, sent_at = ?, last_error = NULL
+                WHERE id = ?
+            ''', (delivery["attempts"], delivery["message_id"], delivery["sent_at"], outbox_id))
+            # Payload is one alarm, a list of coalesced alarms, or None for plain text
+            events = json.loads(delivery["payload"]) if delivery["payload"] else []
+            if isinstance(events, dict):
+                events = [events]
+            # Only the first destination to deliver logs the alarm; the UPDATE above
+            # holds the write lock, so concurrent sends of one alert cannot both log it
+            if events and conn.execute(
+                "SELECT 1 FROM outbox WHERE alert_id = ? AND id != ? AND status = 'sent' LIMIT 1",
+                (alert_id, outbox_id)
+            ).fetchone():
+                events = []
+            insert_sent_logs(conn, events, datetime.strptime(delivery["created_at"], "%Y-%m-%d %H:%M:%S"))
+        if events:
+            live_feed.notify()
+        print(f"[Outbox] Alert {outbox_id} delivered as message {delivery['message_id']}")
+        self.finished()
+
+    def retry(self, outbox_id, attempts, detail, delay=None):
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            self.fail(outbox_id, attempts, detail)
+            return
+        if delay is None:
+            delay = min(OUTBOX_BACKOFF_BASE ** attempts, OUTBOX_BACKOFF_MAX) * random.uniform(0.8, 1.2)
+        with db_transaction() as conn:
+            conn.execute('''
+                UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ?
+                WHERE id = ?
+            ''', (attempts, time.time() + delay, detail, outbox_id))
+        print(f"[Outbox] Alert {outbox_id} attempt {attempts} failed, retrying in {delay:.1f}s: {detail}")
+
+    def fail(self, outbox_id, attempts, detail):
+        with db_transaction() as conn:
+            conn.execute('''
+                UPDATE outbox SET status = 'failed', attempts = ?, last_error = ?
+                WHERE id = ?
+            ''', (attempts, detail, outbox_id))
+        print(f"[Outbox Error] Alert {outbox_id} gave up after {attempts} attempts: {detail}")
+        self.finished()
+
+    def finished(self):
+        with self.delivered:
+            self.delivered.notify_all()
+
+
+outbox_dispatcher = OutboxDispatcher()
+
+@app.get("/alert_status/{outbox_id}")
+def alert_status(outbox_id: int):
+    row = get_outbox_row(outbox_id)
+    if row is None:
+        return {"error": f"Alert {outbox_id} not found."}
+    return row
+
+@app.get("/alert_delivery/{alert_id}")
+def alert_delivery(alert_id: int):
+    return alert_delivery_response(get_alert_rows(alert_id))
+
+# ========== Alert Routing ==========
+# Each route sends alarms from one section (or any section) and an optional
+# CH range to its own chats. The control room, CHAT_ID in settings, gets
+# every alarm unless include_control_room is turned off. An alarm no route
+# matches still goes to the control room, so nothing is ever dropped.
+ROUTING_DEFAULTS = {"include_control_room": True, "routes": []}
+
+def routing_config():
+    return {**ROUTING_DEFAULTS, **settings.get("ROUTES", {})}
+
+def route_matches(route, section, ch):
+    if route.get("section") is not None and route["section"] != section:
+        return False
+    if route.get("ch_min") is not None and ch < route["ch_min"]:
+        return False
+    if route.get("ch_max") is not None and ch > route["ch_max"]:
+        return False
+    return True
+
+def resolve_destinations(section, ch):
+    """Chat IDs an alarm at `ch` in `section` goes to, control room first, without duplicates."""
+    config = routing_config()
+    destinations = [settings['CHAT_ID']] if config["include_control_room"] else []
+    for route in config["routes"]:
+        if route_matches(route, section, float(ch)):
+            destinations += route["chat_ids"]
+    if not destinations:
+        destinations = [settings['CHAT_ID']]
+    return list(dict.fromkeys(str(chat_id) for chat_id in destinations))
+
+class AlertRoute(BaseModel):
+    name: Optional[str] = None
+    section: Optional[str] = None
+    ch_min: Optional[float] = None
+    ch_max: Optional[float] = None
+    chat_ids: List[str]
+
+class RoutingConfig(BaseModel):
+    include_control_room: bool = ROUTING_DEFAULTS["include_control_room"]
+    routes: List[AlertRoute] = []
+
+@app.get("/routes")
+def get_routes(section: Optional[str] = None, ch: Optional[float] = None):
+    """The routing table; with section and ch, also where such an alarm would go."""
+    config = routing_config()
+    if section is not None and ch is not None:
+        return {**config, "destinations": resolve_destinations(section, ch)}
+    return config
+
+@app.post("/routes")
+def update_routes(data: RoutingConfig, auth=Depends(verify_api_key)):
+    for n, route in enumerate(data.routes):
+        if not route.chat_ids:
+            raise HTTPException(status_code=400, detail=f"Route {n} has no chat_ids")
+        if route.section is not None and route.section not in section_data:
+            raise HTTPException(status_code=400, detail=f"Route {n}: unknown section '{route.section}'")
+        if route.ch_min is not None and route.ch_max is not None and route.ch_min > route.ch_max:
+            raise HTTPException(status_code=400, detail=f"Route {n}: ch_min is greater than ch_max")
+    try:
+        config = {**settings, "ROUTES": data.dict()}
+        save_settings(config)
+        return {"status": "success", **routing_config()}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"status": "error", "detail": str(e)})
+
+# ========== Alarm Coalescing ==========
+# One intrusion usually fires a burst of alarms at neighbouring ODs. When
+# coalescing is enabled, the first alarm of a burst is sent immediately and
+# opens a group for its section; later alarms within the CH distance and
+# time window join that group instead of each becoming a Telegram message.
+# Each alarm that joins is written to sent_logs straight away, and the
+# group's summary waits in the outbox as a 'held' row due when the window
+# closes; the dispatcher then sends it like any other alert. A restart
+# inside the window therefore loses neither the alarms nor the summary.
+# Limitation: the open groups live in each worker's memory. Under
+# `uvicorn --workers N` a burst spread across workers forms up to one group
+# per worker, so the same intrusion can produce up to N alerts and N
+# summaries, and /coalescing only lists the answering worker's groups. Run a
+# single worker, or route /send_alert to one, when coalescing matters.
+COALESCE_DEFAULTS = {"enabled": False, "ch_distance": 0.5, "window_seconds": 60}
+
+def coalesce_config():
+    return {**COALESCE_DEFAULTS, **settings.get("COALESCE", {})}
+
+
+class AlarmCoalescer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.groups = {}  # section -> open groups, in this worker only (see above)
+        self.next_id = 1
+
+    def offer(self, event):
+        """Return the open group the alarm joined, or None if it should be sent now."""
+        config = coalesce_config()
+        if not config["enabled"]:
+            return None
+
+        section, ch = event["Section"], float(event["CH"])
+        distance, window = float(config["ch_distance"]), float(config["window_seconds"])
+        with self.lock:
+            now = time.monotonic()
+            open_groups = [g for g in self.groups.get(section, []) if now - g["opened"] <= window]
+            for group in open_groups:
+                if group["ch_min"] - distance <= ch <= group["ch_max"] + distance:
+                    if self.hold(group, event):
+                        return group
+                    open_groups.remove(group)  # the dispatcher already took its summary
+                    break
+
+            open_groups.append({
+                "id": self.next_id,
+                "section": section,
+                "opened": now,
+                "due_at": time.time() + window,
+                "alert_id": None,
+                "chat_ids": [],
+                "leader": event,
+                "events": [],
+                "ch_min": ch,
+                "ch_max": ch
+            })
+            self.next_id += 1
+            self.groups[section] = open_groups
+        return None
+
+    def hold(self, group, event):
+        """Log a joining alarm and park the group's updated summary; False if the group has closed."""
+        ch = float(event["CH"])
+        joined = {
+            **group,
+            "events": group["events"] + [event],
+            "ch_min": min(group["ch_min"], ch),
+            "ch_max": max(group["ch_max"], ch)
+        }
+        text = coalesced_summary(joined)
+        # Every chat that was sent one of the grouped alarms gets the summary
+        chat_ids = list(group["chat_ids"])
+        for alarm in [group["leader"]] + joined["events"]:
+            chat_ids += resolve_destinations(group["section"], alarm["CH"])
+        chat_ids = list(dict.fromkeys(chat_ids))
+        new_chats = [chat_id for chat_id in chat_ids if chat_id not in group["chat_ids"]]
+
+        with db_transaction() as conn:
+            alert_id = group["alert_id"]
+            if alert_id is not None:
+                cur = conn.execute(
+                    "UPDATE outbox SET text = ? WHERE alert_id = ? AND status = 'held'", (text, alert_id)
+                )
+                if cur.rowcount == 0:
+                    return False
+            # Payload-less summary: its alarms are logged here, one by one, as they arrive
+            ids = insert_outbox_rows(conn, new_chats, text, None, "held", group["due_at"], alert_id)
+            insert_sent_logs(conn, [event], datetime.now())
+
+        group.update(joined, chat_ids=chat_ids, alert_id=alert_id if alert_id is not None else ids[0])
+        live_feed.notify()
+        outbox_dispatcher.notify()  # so it wakes when the window closes
+        return True
+
+    def open_groups(self):
+        window = float(coalesce_config()["window_seconds"])
+        with self.lock:
+            now = time.monotonic()
+            return [
+                {
+                    "group_id": g["id"],
+                    "alert_id": g["alert_id"],
+                    "section": g["section"],
+                    "count": len(g["events"]) + 1,
+                    "ch_min": g["ch_min"],
+                    "ch_max": g["ch_max"]
+                }
+                for groups in self.groups.values() for g in groups if now - g["opened"] <= window
+            ]
+
+
+def coalesced_summary(group):
+    leader, events = group["leader"], group["events"]
+    walkers = sorted({e["LineWalker"] for e in [leader] + events if e["LineWalker"]})
+    first = datetime.strptime(leader["At"], "%Y-%m-%d %H:%M:%S")
+    last = datetime.strptime(events[-1]["At"], "%Y-%m-%d %H:%M:%S")
+    return (
+        "🔔 अलार्म सारांश 🔔\n"
+        f"⏱️समय: {first.strftime('%d-%m-%Y %H:%M:%S')} – {last.strftime('%H:%M:%S')}\n"
+        f"🔢अलार्म संख्या: {len(events) + 1} (पहला अलार्म पहले भेजा गया)\n"
+        f"📍CH: {group['ch_min']} – {group['ch_max']}\n"
+        f"📈सेक्शन: {group['section']}\n"
+        f"🚶‍➡️लाइन वॉकर: {', '.join(walkers) or '-'}"
+    )
 
-threading.Thread(target=clear_duty_status_if_due, daemon=True).start()
+
+alarm_coalescer = AlarmCoalescer()
+
+class CoalesceConfig(BaseModel):
+    enabled: bool
+    ch_distance: float = COALESCE_DEFAULTS["ch_distance"]
+    window_seconds: float = COALESCE_DEFAULTS["window_seconds"]
+
+@app.get("/coalescing")
+def get_coalescing():
+    return {**coalesce_config(), "open_groups": alarm_coalescer.open_groups()}
+
+@app.post("/coalescing")
+def update_coalescing(data: CoalesceConfig, auth=Depends(verify_api_key)):
+    try:
+        config = {**settings, "COALESCE": data.dict()}
+        save_settings(config)
+        return {"status": "success", **coalesce_config()}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"status": "error", "detail": str(e)})
 
 @app.get("/set_webhook")
 def set_webhook():
     try:
-        url = f"https://api.telegram.org/bot{settings['BOT_TOKEN']}/setWebhook"
         webhook_url = "https://pids-alert-backend.onrender.com/webhook"
-        res = requests.get(url, params={"url": webhook_url})
+        res = telegram_request("GET", "setWebhook", params={"url": webhook_url})
         return res.json()
     except Exception as e:
         return {"status": "error", "detail": str(e)}
 
 # ============== View Logs and Export to Excel ============
-@app.get("/view_logs")
-def view_logs():
+# Exports read straight from SQLite cursors in chunks and write each row out
+# as they go: openpyxl write-only mode for Excel (into a per-request temp
+# file), or streamed CSV/NDJSON for large ranges. Memory use stays flat no
+# matter how much history is in the database.
+EXPORT_CHUNK = 1000
+EXPORT_FORMATS = {"xlsx", "csv", "ndjson"}
+XLSX_MEDIA_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# table -> (sheet title, time column, whether that column is an epoch or "YYYY-MM-DD HH:MM:SS" text)
+EXPORT_TABLES = {
+    "received_messages": ("Received Logs", "timestamp", False),
+    "duty_status": ("Duty Status", "timestamp", False),
+    "sent_logs": ("Sent Logs", "ts", True),
+}
+
+def parse_export_time(value, is_end=False):
+    if not value:
+        return None
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if fmt == "%Y-%m-%d" and is_end:
+            parsed += timedelta(days=1)  # a bare end date includes that whole day
+        return parsed.strftime("%Y-%m-%d %H:%M:%S")
+    raise HTTPException(status_code=400, detail=f"Invalid date '{value}'. Use YYYY-MM-DD or YYYY-MM-DD HH:MM:SS")
+
+def parse_export_tables(tables):
+    if not tables:
+        return list(EXPORT_TABLES)
+    names = [t.strip() for t in tables.split(",") if t.strip()]
+    unknown = [t for t in names if t not in EXPORT_TABLES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown table(s): {', '.join(unknown)}. Use: {', '.join(EXPORT_TABLES)}")
+    return names
+
+def time_range_clauses(table, start, end):
+    """SQL clauses and params limiting a log table to [start, end)."""
+    _, column, is_epoch = EXPORT_TABLES[table]
+    clauses, params = [], []
+    for bound, op in ((start, ">="), (end, "<")):
+        if bound:
+            if is_epoch:
+                bound = int(datetime.strptime(bound, "%Y-%m-%d %H:%M:%S").timestamp())
+            clauses.append(f"{column} {op} ?")
+            params.append(bound)
+    return clauses, params
+
+def query_export_rows(conn, table, start, end):
+    """Return (columns, row iterator) for one table within [start, end).
+
+    Rows already moved to archive files are merged in by id, so exports
+    look the same before and after a month is archived.
+    """
+    clauses, params = time_range_clauses(table, start, end)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    cur = conn.execute(f"SELECT * FROM {table}{where} ORDER BY id", params)
+    columns = [d[0] for d in cur.description]
+
+    def rows():
+        while True:
+            chunk = cur.fetchmany(EXPORT_CHUNK)
+            if not chunk:
+                break
+            yield from chunk
+
+    archived = [
+        (tuple(row.get(c) for c in columns) for row in part)
+        for part in archived_rows(table, start, end)
+    ]
+    if not archived:
+        return columns, rows()
+    id_pos = columns.index("id")
+    return columns, heapq.merge(*archived, rows(), key=lambda row: row[id_pos])
+
+def write_excel_export(path, tables, start, end):
+    import openpyxl  # only needed for Excel exports
+
+    wb = openpyxl.Workbook(write_only=True)
+    conn = open_db_reader()
     try:
-        conn = sqlite3.connect(DB_FILE)
-        df_recv = pd.read_sql("SELECT * FROM received_messages", conn)
-        df_duty = pd.read_sql("SELECT * FROM duty_status", conn)
-        df_sent = pd.read_sql("SELECT * FROM sent_logs", conn)
+        for table in tables:
+            ws = wb.create_sheet(title=EXPORT_TABLES[table][0])
+            columns, rows = query_export_rows(conn, table, start, end)
+            ws.append(columns)
+            for row in rows:
+                ws.append(row)
+    finally:
+        conn.close()
+    wb.save(path)
+
+def stream_csv_export(table, start, end):
+    conn = open_db_reader()
+    try:
+        columns, rows = query_export_rows(conn, table, start, end)
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(columns)
+        for n, row in enumerate(rows, 1):
+            writer.writerow(row)
+            if n % EXPORT_CHUNK == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+    finally:
         conn.close()
 
-        # Create Excel file
-        wb = openpyxl.Workbook()
-        ws1 = wb.active
-        ws1.title = "Received Logs"
-        ws1.append(df_recv.columns.tolist())
-        for row in df_recv.itertuples(index=False):
-            ws1.append(list(row))
-
-        ws2 = wb.create_sheet(title="Duty Status")
-        ws2.append(df_duty.columns.tolist())
-        for row in df_duty.itertuples(index=False):
-            ws2.append(list(row))
-
-        ws3 = wb.create_sheet(title="Sent Logs")
-        ws3.append(df_sent.columns.tolist())
-        for row in df_sent.itertuples(index=False):
-            ws3.append(list(row))
-
-        wb.save(EXCEL_EXPORT_FILE)
+def stream_ndjson_export(tables, start, end):
+    conn = open_db_reader()
+    try:
+        for table in tables:
+            columns, rows = query_export_rows(conn, table, start, end)
+            lines = []
+            for row in rows:
+                lines.append(json.dumps({"table": table, **dict(zip(columns, row))}, ensure_ascii=False))
+                if len(lines) == EXPORT_CHUNK:
+                    yield "\n".join(lines) + "\n"
+                    lines = []
+            if lines:
+                yield "\n".join(lines) + "\n"
+    finally:
+        conn.close()
+
+@app.get("/view_logs")
+def view_logs(start: str = None, end: str = None, tables: str = None):
+    try:
+        write_excel_export(EXCEL_EXPORT_FILE, parse_export_tables(tables), parse_export_time(start), parse_export_time(end, is_end=True))
         os.startfile(EXCEL_EXPORT_FILE)  # or subprocess on Mac/Linux
         return {"status": "opened_excel", "file": EXCEL_EXPORT_FILE}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/download_logs")
-def download_logs():
+def download_logs(start: str = None, end: str = None, tables: str = None, format: str = "xlsx"):
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Use one of: {', '.join(sorted(EXPORT_FORMATS))}")
+    table_list = parse_export_tables(tables)
+    start, end = parse_export_time(start), parse_export_time(end, is_end=True)
+
+    if format == "csv":
+        if len(table_list) != 1:
+            raise HTTPException(status_code=400, detail="CSV export needs exactly one table, e.g. tables=sent_logs")
+        return StreamingResponse(
+            stream_csv_export(table_list[0], start, end),
+            media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="PIDS_{table_list[0]}.csv"'}
+        )
+    if format == "ndjson":
+        return StreamingResponse(
+            stream_ndjson_export(table_list, start, end),
+            media_type="application/x-ndjson",
+            headers={"Content-Disposition": 'attachment; filename="PIDS_Log_Export.ndjson"'}
+        )
+
     try:
-        # Reuse same code to generate Excel
-        conn = sqlite3.connect(DB_FILE)
-        df_recv = pd.read_sql("SELECT * FROM received_messages", conn)
-        df_duty = pd.read_sql("SELECT * FROM duty_status", conn)
-        df_sent = pd.read_sql("SELECT * FROM sent_logs", conn)
-        conn.close()
+        # Each request gets its own file so concurrent downloads never collide
+        fd, path = tempfile.mkstemp(prefix="pids_export_", suffix=".xlsx")
+        os.close(fd)
+        try:
+            write_excel_export(path, table_list, start, end)
+        except Exception:
+            os.remove(path)
+            raise
 
-        wb = openpyxl.Workbook()
-        ws1 = wb.active
-        ws1.title = "Received Logs"
-        ws1.append(df_recv.columns.tolist())
-        for row in df_recv.itertuples(index=False):
-            ws1.append(list(row))
+        return FileResponse(
+            path,
+            media_type=XLSX_MEDIA_TYPE,
+            filename="PIDS_Log_Export.xlsx",
+            background=BackgroundTask(os.remove, path)
+        )
 
-        ws2 = wb.create_sheet(title="Duty Status")
-        ws2.append(df_duty.columns.tolist())
-        for row in df_duty.itertuples(index=False):
-            ws2.append(list(row))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        ws3 = wb.create_sheet(title="Sent Logs")
-        ws3.append(df_sent.columns.tolist())
-        for row in df_sent.itertuples(index=False):
-            ws3.append(list(row))
 
-        wb.save(EXCEL_EXPORT_FILE)
+# ============== Paginated Log Queries ============
+# Keyset pagination on the row id. With `after`, rows newer than the cursor
+# come back oldest first, which is how the desktop GUI polls for new rows.
+# Otherwise pages run newest first and `before` continues from the last page.
+PAGE_LIMIT_MAX = 1000
+
+@app.get("/logs/{table}")
+def get_log_page(
+    table: str,
+    after: int = None,
+    before: int = None,
+    limit: int = 100,
+    section: str = None,
+    linewalker: str = None,
+    start: str = None,
+    end: str = None
+):
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=400, detail=f"Unknown table '{table}'. Use: {', '.join(EXPORT_TABLES)}")
+    if section is not None and table != "sent_logs":
+        raise HTTPException(status_code=400, detail="Section filter only applies to sent_logs")
+    limit = max(1, min(limit, PAGE_LIMIT_MAX))
+
+    clauses, params = [], []
+    if after is not None:
+        clauses.append("id > ?")
+        params.append(after)
+    if before is not None:
+        clauses.append("id < ?")
+        params.append(before)
+    if section is not None:
+        clauses.append("section = ?")
+        params.append(section)
+    if linewalker is not None:
+        clauses.append("linewalker = ?")
+        params.append(linewalker)
+    time_clauses, time_params = time_range_clauses(table, parse_export_time(start), parse_export_time(end, is_end=True))
+    clauses += time_clauses
+    params += time_params
+
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    order = "ASC" if after is not None else "DESC"
+    cur = get_db().execute(f"SELECT * FROM {table}{where} ORDER BY id {order} LIMIT ?", params + [limit])
+    columns = [d[0] for d in cur.description]
+    rows = [dict(zip(columns, row)) for row in cur.fetchall()]
+
+    # Archives are only read when the caller asks for a time range that
+    # reaches into an archived month, never for plain `after` polling
+    if start:
+        def wanted(row):
+            return (
+                (after is None or row["id"] > after)
+                and (before is None or row["id"] < before)
+                and (section is None or row.get("section") == section)
+                and (linewalker is None or row.get("linewalker") == linewalker)
+            )
+        archived = [row for part in archived_rows(table, parse_export_time(start), parse_export_time(end, is_end=True)) for row in part if wanted(row)]
+        if archived:
+            merged = sorted(rows + [{c: row.get(c) for c in columns} for row in archived], key=lambda row: row["id"], reverse=order == "DESC")
+            rows = merged[:limit]
+
+    ids = [row["id"] for row in rows]
+    return {
+        "rows": rows,
+        # Newest id seen: pass as `after` to poll for new rows
+        "cursor": max(ids) if ids else after,
+        # Oldest id seen: pass as `before` for the next (older) page
+        "next_before": min(ids) if len(rows) == limit else None
+    }
 
-        return FileResponse(
-            EXCEL_EXPORT_FILE,
-            media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            filename="PIDS_Log_Export.xlsx"
-        )
 
+# ============== Retention and Archives ============
+# Closed months older than the last `keep_months` are moved out of the hot
+# tables into append-only gzip NDJSON files under archive/, one per table
+# and month, each with a small JSON index (row count, id and time range,
+# compressed size). Reads of a time range that reaches an archived month
+# merge the archive back in. Archiving is idempotent: rows up to the
+# index's max_id are known to be safe on disk, so a crash between writing
+# and deleting only repeats the delete. Late rows for an archived month are
+# appended to its file as a new gzip member. Rows whose date cannot be read
+# are left in place and reported. Archiving is off until enabled under
+# "RETENTION" in settings.json.
+ARCHIVE_DIR = "archive"
+RETENTION_DEFAULTS = {"enabled": False, "keep_months": 3}
+RETENTION_HOUR = 3  # daily run at 03:00 local time
+RETENTION_STARTUP_DELAY = 60  # seconds; first run after startup catches up
+retention_lock = threading.Lock()
+
+def retention_config():
+    return {**RETENTION_DEFAULTS, **settings.get("RETENTION", {})}
+
+def month_start(moment, months_back=0):
+    index = moment.year * 12 + moment.month - 1 - months_back
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def month_range(month):
+    """("2026-07") -> ("2026-07-01 00:00:00", "2026-08-01 00:00:00")"""
+    start = datetime.strptime(month, "%Y-%m")
+    end = month_start(start, -1)
+    return start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S")
+
+def archive_paths(table, month):
+    base = os.path.join(ARCHIVE_DIR, f"{table}-{month}")
+    return base + ".ndjson.gz", base + ".index.json"
+
+def read_archive_index(table, month):
+    _, index_path = archive_paths(table, month)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path) as f:
+        return json.load(f)
+
+def list_archives(table=None):
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    indexes = []
+    for name in sorted(os.listdir(ARCHIVE_DIR)):
+        if name.endswith(".index.json"):
+            with open(os.path.join(ARCHIVE_DIR, name)) as f:
+                index = json.load(f)
+            if table is None or index["table"] == table:
+                indexes.append(index)
+    return indexes
+
+def read_archive_file(index):
+    """Yield the archived rows of one file as dicts, in id order."""
+    data_path, _ = archive_paths(index["table"], index["month"])
+    with open(data_path, "rb") as raw:
+        # Anything past the indexed size is a write that never completed
+        compressed = raw.read(index["bytes"])
+    with gzip.GzipFile(fileobj=io.BytesIO(compressed)) as f:
+        for line in f:
+            yield json.loads(line)
+
+def archived_rows(table, start, end):
+    """One id-ordered row iterator per archive file overlapping [start, end)."""
+    _, column, is_epoch = EXPORT_TABLES[table]
+    lo, hi = start, end
+    if is_epoch:
+        lo = int(datetime.strptime(start, "%Y-%m-%d %H:%M:%S").timestamp()) if start else None
+        hi = int(datetime.strptime(end, "%Y-%m-%d %H:%M:%S").timestamp()) if end else None
+
+    def within(row):
+        value = row.get(column)
+        return value is not None and (lo is None or value >= lo) and (hi is None or value < hi)
+
+    parts = []
+    for index in list_archives(table):
+        month_lo, month_hi = month_range(index["month"])
+        if (start and start >= month_hi) or (end and end <= month_lo):
+            continue
+        parts.append(row for row in read_archive_file(index) if within(row))
+    return parts
+
+def archive_month(table, month):
+    """Move one month of a table into its archive file; returns rows moved."""
+    data_path, index_path = archive_paths(table, month)
+    index = read_archive_index(table, month) or {
+        "table": table, "month": month, "rows": 0, "min_id": None, "max_id": 0,
+        "first": None, "last": None, "members": 0, "bytes": 0
+    }
+    _, column, _ = EXPORT_TABLES[table]
+    clauses, params = time_range_clauses(table, *month_range(month))
+    where = " AND ".join(clauses)
+
+    conn = get_db()
+    cur = conn.execute(f"SELECT * FROM {table} WHERE {where} AND id > ? ORDER BY id", params + [index["max_id"]])
+    columns = [d[0] for d in cur.description]
+    rows = [dict(zip(columns, row)) for row in cur.fetchall()]
+
+    if rows:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        with open(data_path, "ab") as raw:
+            raw.truncate(index["bytes"])  # drop the tail of an interrupted write
+            with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                for chunk_start in range(0, len(rows), EXPORT_CHUNK):
+                    chunk = rows[chunk_start:chunk_start + EXPORT_CHUNK]
+                    f.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in chunk).encode("utf-8"))
+            raw.flush()
+            os.fsync(raw.fileno())
+            size = raw.tell()
+
+        values = [row[column] for row in rows if row[column] is not None]
+        index.update({
+            "rows": index["rows"] + len(rows),
+            "min_id": index["min_id"] if index["min_id"] is not None else rows[0]["id"],
+            "max_id": rows[-1]["id"],
+            "first": min([v for v in (index["first"], min(values, default=None)) if v is not None], default=None),
+            "last": max([v for v in (index["last"], max(values, default=None)) if v is not None], default=None),
+            "members": index["members"] + 1,
+            "bytes": size,
+            "columns": columns,
+            "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        })
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, index_path)
+
+    if index["max_id"]:
+        with db_transaction() as conn:
+            conn.execute(f"DELETE FROM {table} WHERE {where} AND id <= ?", params + [index["max_id"]])
+    return len(rows)
+
+def closed_months(table, cutoff):
+    """Months before cutoff that hold rows of table, and the number of rows
+    before cutoff whose date is malformed (those are never archived)."""
+    _, column, is_epoch = EXPORT_TABLES[table]
+    conn = get_db()
+    if is_epoch:
+        rows = conn.execute(f'''
+            SELECT strftime('%Y-%m', {column}, 'unixepoch', 'localtime'), COUNT(*) FROM {table}
+            WHERE typeof({column}) IN ('integer', 'real') AND {column} < ? GROUP BY 1
+        ''', (int(cutoff.timestamp()),)).fetchall()
+        bad = conn.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE {column} IS NOT NULL AND typeof({column}) NOT IN ('integer', 'real')"
+        ).fetchone()[0]
+    else:
+        rows = conn.execute(
+            f"SELECT substr({column}, 1, 7), COUNT(*) FROM {table} WHERE {column} < ? GROUP BY 1",
+            (cutoff.strftime("%Y-%m-%d %H:%M:%S"),)
+        ).fetchall()
+        bad = 0
+
+    months = []
+    for month, count in rows:
+        try:
+            months.append(datetime.strptime(month or "", "%Y-%m").strftime("%Y-%m"))
+        except ValueError:
+            bad += count
+    return months, bad
+
+def archive_closed_months(keep_months):
+    """Archive every month before the last `keep_months` (the current one included).
+
+    Returns ({table: {month: rows moved}}, {table: malformed rows skipped}).
+    """
+    cutoff = month_start(datetime.now(), max(keep_months, 1) - 1)
+    moved, skipped = {}, {}
+    for table in EXPORT_TABLES:
+        months, bad = closed_months(table, cutoff)
+        if bad:
+            skipped[table] = bad
+            print(f"[Retention] Skipped {bad} {table} rows with a malformed date")
+        for month in months:
+            count = archive_month(table, month)
+            if count:
+                moved.setdefault(table, {})[month] = count
+
+    if moved:
+        freed = get_db().execute("PRAGMA freelist_count").fetchone()[0]
+        get_db().execute("PRAGMA incremental_vacuum").fetchall()  # frees one page per step
+        print(f"[Retention] Archived {sum(sum(m.values()) for m in moved.values())} rows, released {freed} pages")
+    return moved, skipped
+
+def run_retention():
+    try:
+        with retention_lock:
+            config = retention_config()
+            if config["enabled"] and hold_lease("retention"):
+                archive_closed_months(int(config["keep_months"]))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        print(f"[Retention Error] {e}")
+
+    next_run = datetime.now().replace(hour=RETENTION_HOUR, minute=0, second=0, microsecond=0)
+    if next_run <= datetime.now():
+        next_run += timedelta(days=1)
+    scheduler.schedule("retention", next_run.timestamp(), run_retention)
+
+def schedule_retention():
+    scheduler.schedule("retention", time.time() + RETENTION_STARTUP_DELAY, run_retention)
+
+class RetentionConfig(BaseModel):
+    enabled: bool = RETENTION_DEFAULTS["enabled"]
+    keep_months: int = RETENTION_DEFAULTS["keep_months"]
+
+@app.get("/retention")
+def get_retention():
+    return {**retention_config(), "archives": list_archives()}
+
+@app.post("/retention")
+def update_retention(data: RetentionConfig, auth=Depends(verify_api_key)):
+    if data.keep_months < 1:
+        raise HTTPException(status_code=400, detail="keep_months must be at least 1")
+    try:
+        config = {**settings, "RETENTION": data.dict()}
+        save_settings(config)
+        return {"status": "success", **retention_config()}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"status": "error", "detail": str(e)})
+
+@app.post("/retention/run")
+def run_retention_now(auth=Depends(verify_api_key)):
+    with retention_lock:
+        if not hold_lease("retention"):
+            raise HTTPException(status_code=409, detail="Retention is already running in another worker")
+        moved, skipped = archive_closed_months(int(retention_config()["keep_months"]))
+    return {"status": "success", "archived": moved, "skipped": skipped}
+
+
+# ============== Live Feed ============
+# Server-Sent Events stream of new received_messages, duty_status and
+# sent_logs rows. Writers call live_feed.notify() once they have committed;
+# a single task on the event loop then reads the new rows once and fans them
+# out to every connected client. Each event id is the cursor
+# "<received_messages id>.<duty_status id>.<sent_logs id>", so a client that
+# reconnects with Last-Event-ID (or ?cursor=) resumes exactly where it left
+# off. A client whose queue fills up stops being fed and catches up from the
+# database on its own, so one slow client never holds up the others.
+LIVE_TABLES = ("received_messages", "duty_status", "sent_logs")
+LIVE_QUEUE_SIZE = 256
+LIVE_PAGE_SIZE = 500
+LIVE_HEARTBEAT = 15.0  # seconds between keep-alive comments
+LIVE_POLL_INTERVAL = 1.0  # how often to look for rows committed by other workers
+
+def read_live_rows(cursor, limit=LIVE_PAGE_SIZE):
+    """(table, row) pairs newer than cursor, in id order within each table."""
+    conn = get_db()
+    rows = []
+    for table in LIVE_TABLES:
+        cur = conn.execute(f"SELECT * FROM {table} WHERE id > ? ORDER BY id LIMIT ?", (cursor[table], limit))
+        columns = [d[0] for d in cur.description]
+        rows += [(table, dict(zip(columns, row))) for row in cur.fetchall()]
+    return rows
+
+def format_live_cursor(cursor):
+    return ".".join(str(cursor[table]) for table in LIVE_TABLES)
+
+def parse_live_cursor(value):
+    try:
+        ids = [int(part) for part in value.split(".")]
+    except ValueError:
+        ids = []
+    if len(ids) != len(LIVE_TABLES):
+        raise HTTPException(status_code=400, detail=f"Invalid cursor '{value}'. Use {'.'.join(f'<{t} id>' for t in LIVE_TABLES)}")
+    return dict(zip(LIVE_TABLES, ids))
+
+
+class LiveSubscriber:
+    def __init__(self, cursor):
+        self.cursor = dict(cursor)
+        self.queue = asyncio.Queue(LIVE_QUEUE_SIZE)
+        self.behind = True  # start by catching up from the database
+
+    def event(self, table, row):
+        """SSE frame for a row, or None if the cursor is already past it."""
+        if row["id"] <= self.cursor[table]:
+            return None
+        self.cursor[table] = row["id"]
+        return f"id: {format_live_cursor(self.cursor)}\nevent: {table}\ndata: {json.dumps(row, ensure_ascii=False)}\n\n"
+
+
+class LiveFeed:
+    def __init__(self):
+        self.loop = None
+        self.changed = None
+        self.task = None
+        self.head = None
+        self.poll_conn = None
+        self.subscribers = set()
+        self.stats = {"events": 0, "lagged": 0}
+
+    def start(self):
+        conn = get_db()
+        self.head = {
+            table: conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+            for table in LIVE_TABLES
+        }
+        self.poll_conn = open_db_reader()
+        self.loop = asyncio.get_running_loop()
+        self.changed = asyncio.Event()
+        self.task = self.loop.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.poll_conn is not None:
+            self.poll_conn.close()
+            self.poll_conn = None
+        self.loop = None
+
+    def notify(self):
+        """Called from any thread after new rows are committed."""
+        loop = self.loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self.changed.set)
+            except RuntimeError:
+                pass  # loop already closed during shutdown
+
+    async def run(self):
+        version = await asyncio.to_thread(data_version, self.poll_conn)
+        while True:
+            try:
+                await asyncio.wait_for(self.changed.wait(), LIVE_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                # Rows written by other workers never call notify() here
+                current = await asyncio.to_thread(data_version, self.poll_conn)
+                if current == version:
+                    continue
+                version = current
+            self.changed.clear()
+            try:
+                rows = await asyncio.to_thread(read_live_rows, dict(self.head))
+            except Exception as e:
+                print(f"[Live Feed Error] {e}")
+                continue
+            if len(rows) >= LIVE_PAGE_SIZE:
+                self.changed.set()  # a table may have more than one page
+            for table, row in rows:
+                self.head[table] = max(self.head[table], row["id"])
+            self.stats["events"] += len(rows)
+
+            for sub in list(self.subscribers):
+                if sub.behind:
+                    continue
+                for item in rows:
+                    try:
+                        sub.queue.put_nowait(item)
+                    except asyncio.QueueFull:
+                        sub.behind = True
+                        self.stats["lagged"] += 1
+                        break
+
+    async def stream(self, cursor):
+        sub = LiveSubscriber(cursor)
+        self.subscribers.add(sub)
+        try:
+            while True:
+                if sub.behind:
+                    # Anything dropped from the queue is already committed,
+                    # so reading from the cursor after draining misses nothing
+                    sub.behind = False
+                    while not sub.queue.empty():
+                        sub.queue.get_nowait()
+                    while True:
+                        rows = await asyncio.to_thread(read_live_rows, dict(sub.cursor))
+                        frames = [f for f in (sub.event(table, row) for table, row in rows) if f]
+                        if not frames:
+                            break
+                        yield "".join(frames)
+                    continue
+
+                try:
+                    table, row = await asyncio.wait_for(sub.queue.get(), LIVE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                frame = sub.event(table, row)
+                if frame:
+                    yield frame
+        finally:
+            self.subscribers.discard(sub)
+
+    def snapshot(self):
+        return {
+            "clients": len(self.subscribers),
+            "cursor": format_live_cursor(self.head) if self.head else None,
+            **self.stats
+        }
+
+
+live_feed = LiveFeed()
+
+@app.get("/live")
+def live(cursor: str = None, last_event_id: str = Header(None)):
+    """Stream new rows as Server-Sent Events.
+
+    Without a cursor the stream starts at the newest rows; pass the last
+    event id (EventSource does this on reconnect) to replay what was missed.
+    """
+    resume = last_event_id or cursor
+    start = parse_live_cursor(resume) if resume else dict(live_feed.head)
+    return StreamingResponse(
+        live_feed.stream(start),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/live_stats")
+def live_stats():
+    return live_feed.snapshot()
 
 
 # ================ Analytics Charts from SQLite ===============
-@app.get("/analytics/scatter_chart")
-def get_scatter_chart():
+def current_shift_window(now=None):
+    """Start and end of the 06:30 to 06:30 shift containing `now`."""
+    now = now or datetime.now()
+    today_630 = now.replace(hour=6, minute=30, second=0, microsecond=0)
+    if now < today_630:
+        today_630 -= timedelta(days=1)
+    return today_630, today_630 + timedelta(days=1)
+
+def shift_epoch_bounds(now=None):
+    start, end = current_shift_window(now)
+    return int(start.timestamp()), int(end.timestamp())
+
+# Rendered PNGs are cached under (chart, parameter, shift window, newest
+# sent_logs id). A new alarm or a new shift changes the key, so stale
+# entries simply age out of the LRU. The key doubles as the ETag, which
+# lets the desktop client's refreshes get a 304 without touching matplotlib.
+CHART_CACHE_SIZE = 32
+GROUPING_FIELDS = {
+    "section": "section",
+    "linewalker": "linewalker",
+}
+
+
+class ChartCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            png = self.entries.get(key)
+            if png is not None:
+                self.entries.move_to_end(key)
+            return png
+
+    def put(self, key, png):
+        with self.lock:
+            self.entries[key] = png
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+chart_cache = ChartCache(CHART_CACHE_SIZE)
+
+def latest_sent_log_id():
+    return get_db().execute("SELECT MAX(id) FROM sent_logs").fetchone()[0] or 0
+
+def cached_chart_response(request, chart, param, render):
+    bounds = shift_epoch_bounds()
+    key = (chart, param, bounds, latest_sent_log_id())
+    etag = '"' + hashlib.sha1(repr(key).encode()).hexdigest()[:20] + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    png = chart_cache.get(key)
+    if png is None:
+        png = render(bounds)
+        chart_cache.put(key, png)
+    return Response(content=png, media_type="image/png", headers=headers)
+
+# ========== Chart Worker Pool ==========
+# matplotlib runs in a small pool of spawned worker processes (charts.py),
+# never in the API's threads. CHART_QUEUE_LIMIT caps how many renders can
+# be running or waiting at once: beyond that the endpoint answers 503 right
+# away. A render that takes longer than CHART_RENDER_TIMEOUT gets a 504.
+# Alerts and webhooks never wait behind a chart.
+CHART_WORKERS = 1
+CHART_QUEUE_LIMIT = 4
+CHART_RENDER_TIMEOUT = 20  # seconds
+
+chart_pool = None
+chart_pool_lock = threading.Lock()
+chart_slots = threading.BoundedSemaphore(CHART_QUEUE_LIMIT)
+
+def get_chart_pool():
+    global chart_pool
+    with chart_pool_lock:
+        if chart_pool is None:
+            chart_pool = ProcessPoolExecutor(max_workers=CHART_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return chart_pool
+
+def submit_chart(func, *args):
+    if not chart_slots.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail="Chart renderer busy, try again shortly")
     try:
-        conn = sqlite3.connect(DB_FILE)
-        df = pd.read_sql("SELECT * FROM sent_logs", conn)
-        conn.close()
+        future = get_chart_pool().submit(func, *args)
+    except Exception:
+        chart_slots.release()
+        raise
+    # The slot is held until the worker really finishes, even if we time out
+    future.add_done_callback(lambda _: chart_slots.release())
+    started = time.perf_counter()
+    try:
+        png = future.result(timeout=CHART_RENDER_TIMEOUT)
+        CHART_RENDER_SECONDS.observe(time.perf_counter() - started, func.__name__)
+        return png
+    except FuturesTimeout:
+        raise HTTPException(status_code=504, detail="Chart rendering timed out")
+    except BrokenProcessPool:
+        reset_chart_pool()
+        raise
+
+def reset_chart_pool():
+    # A crashed worker breaks the whole pool; start a fresh one next time
+    global chart_pool
+    with chart_pool_lock:
+        if chart_pool is not None:
+            chart_pool.shutdown(wait=False, cancel_futures=True)
+        chart_pool = None
+
+def render_scatter_chart(bounds):
+    rows = get_db().execute(
+        "SELECT section, date, time, ch_num FROM sent_logs WHERE ts >= ? AND ts < ? ORDER BY section, ts",
+        bounds
+    ).fetchall()
+    series = {}
+    for section, date, time_str, ch in rows:
+        times, chs = series.setdefault(section, ([], []))
+        times.append(datetime.strptime(f"{date} {time_str}", "%Y-%m-%d %H:%M:%S"))
+        chs.append(ch)
+    return submit_chart(charts.render_scatter, [(section, times, chs) for section, (times, chs) in series.items()])
+
+def render_grouping_chart(by, bounds):
+    by_key = get_shift_counts(shift_key(datetime.fromtimestamp(bounds[0])))[GROUPING_FIELDS[by]]
+    return submit_chart(charts.render_grouping, by, list(by_key.keys()), list(by_key.values()))
+
+@app.get("/analytics/shift_counts")
+def get_shift_counts_api(shift: str = None):
+    if shift is None:
+        start = current_shift_window()[0]
+    else:
+        try:
+            start = datetime.strptime(shift, "%Y-%m-%d").replace(hour=6, minute=30)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid shift. Use the shift's start date, YYYY-MM-DD")
 
-        df['datetime'] = pd.to_datetime(df['date'] + ' ' + df['time'])
-        now = datetime.now()
-        today_630 = now.replace(hour=6, minute=30, second=0, microsecond=0)
-        if now < today_630:
-            today_630 -= timedelta(days=1)
-        tomorrow_630 = today_630 + timedelta(days=1)
-        df = df[(df['datetime'] >= today_630) & (df['datetime'] < tomorrow_630)]
-
-        fig, ax = plt.subplots(figsize=(11, 6))
-        for section, group in df.groupby("section"):
-            ax.scatter(group['datetime'], group['ch'].astype(float), label=section, s=40, alpha=0.8)
-
-        ax.set_title("📊 Chainage vs Time (Section-wise, Last 24 Hours)", fontsize=14)
-        ax.set_xlabel("Time", fontsize=12)
-        ax.set_ylabel("Chainage", fontsize=12)
-        ax.legend(title="Section", loc="best")
-        ax.grid(True)
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-        fig.autofmt_xdate()
-
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png')
-        plt.close(fig)
-        buf.seek(0)
-        return StreamingResponse(buf, media_type="image/png")
+    counts = get_shift_counts(shift_key(start))
+    return {
+        "shift_start": start.strftime("%Y-%m-%d %H:%M:%S"),
+        "shift_end": (start + timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S"),
+        "total": sum(counts["section"].values()),
+        "by_section": counts["section"],
+        "by_linewalker": counts["linewalker"],
+        "by_hour": dict(sorted(counts["hour"].items()))
+    }
 
+@app.get("/analytics/scatter_chart")
+def get_scatter_chart(request: Request):
+    try:
+        return cached_chart_response(request, "scatter", None, render_scatter_chart)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/analytics/grouping_chart")
-def get_grouping_chart(by: str = "section"):
+def get_grouping_chart(request: Request, by: str = "section"):
+    if by not in GROUPING_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Invalid group type. Use one of: {', '.join(GROUPING_FIELDS.keys())}")
     try:
-        valid_fields = {
-            "section": "section",
-            "linewalker": "linewalker",
-    
-        }
-        if by not in valid_fields:
-            raise HTTPException(status_code=400, detail=f"Invalid group type. Use one of: {', '.join(valid_fields.keys())}")
-
-        conn = sqlite3.connect(DB_FILE)
-        df = pd.read_sql("SELECT * FROM sent_logs", conn)
-        conn.close()
+        return cached_chart_response(request, "grouping", by, lambda bounds: render_grouping_chart(by, bounds))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        df['datetime'] = pd.to_datetime(df['date'] + ' ' + df['time'])
-        now = datetime.now()
-        today_630 = now.replace(hour=6, minute=30, second=0, microsecond=0)
-        if now < today_630:
-            today_630 -= timedelta(days=1)
-        tomorrow_630 = today_630 + timedelta(days=1)
-        df = df[(df['datetime'] >= today_630) & (df['datetime'] < tomorrow_630)]
-
-        counts = df[by].value_counts()
-
-        fig, ax = plt.subplots(figsize=(10, 6))
-        ax.bar(counts.index.astype(str), counts.values, color='teal')
-        ax.set_title(f"Alarm Count by {by.capitalize()} (Last 24 Hours)", fontsize=14)
-        ax.set_ylabel("Count")
-        ax.set_xlabel(by.capitalize())
-        ax.set_xticks(range(len(counts)))
-        ax.set_xticklabels(counts.index.astype(str), rotation=45, ha='right')
-        ax.grid(axis="y")
-
-        plt.tight_layout()
-        buf = io.BytesIO()
-        plt.savefig(buf, format="png")
-        plt.close(fig)
-        buf.seek(0)
-        return StreamingResponse(buf, media_type="image/png")
+def hotspot_bin_range(bin_index, bin_km):
+    return round(bin_index * bin_km, 3), round((bin_index + 1) * bin_km, 3)
+
+@app.get("/analytics/hotspots")
+def get_hotspots(start: str = None, end: str = None, section: str = None, top: int = HOTSPOT_TOP):
+    """The CH bins with the most alarms between two dates (inclusive; last 28 days by default)."""
+    first, last = parse_hotspot_range(start, end)
+    bin_km = float(hotspot_config()["bin_km"])
+    cells = query_hotspot_cells(first, last, section)
+    ranked = sorted(cells.items(), key=lambda item: sum(item[1]), reverse=True)[:max(top, 0)]
+    by_hour = [sum(hours[hour] for hours in cells.values()) for hour in range(24)]
+
+    hotspots = []
+    for (cell_section, bin_index), hours in ranked:
+        ch_from, ch_to = hotspot_bin_range(bin_index, bin_km)
+        hotspots.append({
+            "section": cell_section,
+            "ch_from": ch_from,
+            "ch_to": ch_to,
+            "count": sum(hours),
+            "peak_hour": hours.index(max(hours)),
+            "by_hour": hours
+        })
+    return {
+        "start": first.strftime("%Y-%m-%d"),
+        "end": last.strftime("%Y-%m-%d"),
+        "bin_km": bin_km,
+        "section": section,
+        "total": sum(by_hour),
+        "by_hour": by_hour,
+        "hotspots": hotspots
+    }
 
+def render_hotspot_chart(first, last, section):
+    bin_km = float(hotspot_config()["bin_km"])
+    by_bin = {}
+    for (_section, bin_index), hours in query_hotspot_cells(first, last, section).items():
+        row = by_bin.setdefault(bin_index, [0] * 24)
+        for hour, count in enumerate(hours):
+            row[hour] += count
+    # Every bin between the lowest and highest, so the CH axis has no jumps
+    bins = list(range(min(by_bin), max(by_bin) + 1)) if by_bin else []
+    labels = ["%g–%g" % hotspot_bin_range(bin_index, bin_km) for bin_index in bins]
+    title = f"Alarm Hotspots {first:%d-%m-%Y} to {last:%d-%m-%Y}" + (f" ({section})" if section else "")
+    return submit_chart(charts.render_heatmap, title, labels, [by_bin.get(bin_index, [0] * 24) for bin_index in bins])
+
+@app.get("/analytics/hotspot_chart")
+def get_hotspot_chart(request: Request, start: str = None, end: str = None, section: str = None):
+    first, last = parse_hotspot_range(start, end)
+    param = (first.date(), last.date(), section, hotspot_config()["bin_km"])
+    try:
+        return cached_chart_response(request, "hotspots", param, lambda _bounds: render_hotspot_chart(first, last, section))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -587,7 +3747,7 @@ class LineWalkerItem(BaseModel):
 # ✅ View all linewalkers
 @app.get("/view_linewalkers")
 def view_linewalkers():
-    return load_linewalkers()
+    return linewalker_data
 
 # ✅ Update linewalkers via frontend
 @app.post("/edit_linewalkers")
@@ -595,80 +3755,111 @@ def edit_linewalkers(data: list[LineWalkerItem]):
     try:
         # Convert to dict list
         data_dicts = [item.dict() for item in data]
-        save_linewalkers(data_dicts)
 
-        # 🔁 Update in-memory variable if used
-        global linewalker_data
-        linewalker_data = data_dicts
+        # 🔁 Publishes to every worker and rebuilds the CH index
+        save_linewalkers(data_dicts)
 
-        return {"status": "updated"}
+        return {"status": "updated", **linewalker_index.report()}
     except Exception as e:
         return {"status": "error", "detail": str(e)}
 
-# ✅ Save linewalkers to file
+# ✅ Save linewalkers to the shared store, mirrored to file
 def save_linewalkers(data):
     now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     for item in data:
         item["saved_at"] = now_str
 
+    publish_state("linewalkers", data)
+    mirror_linewalkers(data)
+
+def mirror_linewalkers(data):
     with open(LINEWALKER_FILE, 'w') as f:
         json.dump(data, f, indent=2)
 
-# ✅ Load and auto-expire linewalkers
+# ✅ Load linewalkers (expiry is handled by the scheduler)
 def load_linewalkers():
     if not os.path.exists(LINEWALKER_FILE):
         return []
 
     with open(LINEWALKER_FILE) as f:
-        data = json.load(f)
-
-    now = datetime.now()
-    updated = False
+        return json.load(f)
 
+# ✅ Auto-expire assignments RESET_DURATION_HOURS after they were saved.
+# Entries saved together share one job, keyed by their saved_at stamp.
+def schedule_linewalker_expiry(data):
+    wanted = {}
     for item in data:
         saved_time_str = item.get("saved_at")
-        if saved_time_str:
-            try:
-                saved_time = datetime.strptime(saved_time_str, "%Y-%m-%d %H:%M:%S")
-                if now - saved_time > timedelta(hours=RESET_DURATION_HOURS):
-                    item["line_walker"] = "-"
-                    item["saved_at"] = None
-                    updated = True
-            except Exception as e:
-                print(f"Invalid saved_at format: {saved_time_str}. Skipping reset.")
-
-    if updated:
-        with open(LINEWALKER_FILE, "w") as f:
-            json.dump(data, f, indent=2)
+        if not saved_time_str or saved_time_str in wanted:
+            continue
+        try:
+            saved_time = datetime.strptime(saved_time_str, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            print(f"Invalid saved_at format: {saved_time_str}. Skipping reset.")
+            continue
+        wanted[saved_time_str] = saved_time + timedelta(hours=RESET_DURATION_HOURS)
+
+    for key in scheduler.keys("linewalker_expiry:"):
+        if key.split(":", 1)[1] not in wanted:
+            scheduler.cancel(key)
+    for saved_time_str, expires in wanted.items():
+        scheduler.schedule(
+            f"linewalker_expiry:{saved_time_str}",
+            expires.timestamp(),
+            lambda saved_at=saved_time_str: expire_linewalkers(saved_at)
+        )
 
-    return data
+def expire_linewalkers(saved_at):
+    # Every worker schedules this; whichever runs first finds the entries
+    expired = 0
+
+    def expire(data):
+        nonlocal expired
+        for item in data or []:
+            if item.get("saved_at") == saved_at:
+                item["line_walker"] = "-"
+                item["saved_at"] = None
+                expired += 1
+        return data if expired else None
+
+    data = update_state("linewalkers", expire)
+    if data is None:
+        return
+    mirror_linewalkers(data)
+    print(f"[✓] {expired} line walker assignment(s) saved at {saved_at} expired")
 
 # Optional refresh endpoint
+# Re-imports linewalkers.json (e.g. after a manual edit) for every worker
 @app.get("/refresh_linewalkers")
 def refresh_linewalkers_api():
     refreshed = load_linewalkers()
+    publish_state("linewalkers", refreshed)
     return {"status": "refreshed", "count": len(refreshed)}
 
 @app.post("/reset_all_linewalkers")
 def reset_all_linewalkers():
-    if not os.path.exists(LINEWALKER_FILE):
-        return {"status": "file_not_found"}
-
-    with open(LINEWALKER_FILE, "r") as f:
-        data = json.load(f)
-
-    for item in data:
-        item["line_walker"] = "-"
-        item["saved_at"] = None
+    def reset(data):
+        for item in data or []:
+            item["line_walker"] = "-"
+            item["saved_at"] = None
+        return data or []
+
+    data = update_state("linewalkers", reset)
+    mirror_linewalkers(data)
+    return {"status": "reset", "count": len(data)}
 
-    with open(LINEWALKER_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+# ✅ Overlaps and gaps found when the CH index was last built
+@app.get("/linewalker_ranges")
+def linewalker_ranges():
+    return linewalker_index.report()
 
-    # update global variable if used
-    global linewalker_data
-    linewalker_data = data
-
-    return {"status": "reset", "count": len(data)}
+# ✅ Resolve many CH values to line walkers at once
+@app.post("/linewalkers_by_ch")
+def linewalkers_by_ch(chs: list[float]):
+    return [
+        {"ch": ch, "line_walker": lw}
+        for ch, lw in zip(chs, get_linewalkers_by_ch(chs))
+    ]
 
 
 @app.get("/ping")
@@ -678,3 +3869,23 @@ def ping():
 def root():
     return {"message": "✅ PIDS Alert Backend is Running"}
 
+
+# ========== Startup ==========
+# Runs in the app lifespan rather than at import, so importing main stays
+# cheap and a cold-started instance can answer as soon as these finish.
+# Chart, export and HTTP client libraries are imported on first use.
+def startup():
+    started = time.perf_counter()
+    init_db()
+    load_settings()
+    seed_state("settings", settings)
+    load_section_tables()
+    refresh_linewalkers()
+    sync_shared_state()
+    rebuild_shift_counts()
+    webhook_writer.start()
+    outbox_dispatcher.start()
+    update_poller.start()
+    schedule_duty_reset()
+    schedule_retention()
+    print(f"[Startup] Ready in {(time.perf_counter() - started) * 1000:.0f} ms")
@@ -0,0 +1,140 @@
+"""Shared fixtures: the app, started in a scratch directory, talking to a fake Bot API.
+
+main.py keeps its data files (log.sqlite, settings.json, archives) relative
+to the working directory, so the session runs from a temporary copy of the
+section CSVs and line walker file. TELEGRAM_API_BASE points every Bot API
+call at FakeBotAPI, a local HTTP server that records the calls and answers
+sendMessage and getUpdates the way Telegram does.
+"""
+import itertools
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_SETTINGS = {"BOT_TOKEN": "123456:test", "CHAT_ID": "1000"}
+API_KEY = {"x-api-key": "Yj@mb51"}  # headers for the endpoints behind verify_api_key
+
+
+class FakeBotAPI:
+    """Records every Bot API call as (monotonic time, method, body).
+
+    sendMessage answers with the next queued (status, body) from `responses`,
+    then with ok; a bytes body is sent as it is. getUpdates serves `updates` from the requested offset,
+    holding the long poll for at most a second so tests stay quick.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                status, payload = api.handle(self.path.rsplit("/", 1)[-1], body)
+                out = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            do_GET = do_POST
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def reset(self):
+        with self.lock:
+            self.calls = []
+            self.responses = []
+            self.updates = []
+            self.message_ids = itertools.count(1)
+
+    def calls_to(self, method):
+        with self.lock:
+            return [call for call in self.calls if call[1] == method]
+
+    def handle(self, method, body):
+        with self.lock:
+            self.calls.append((time.monotonic(), method, body))
+            if method == "sendMessage":
+                if self.responses:
+                    return self.responses.pop(0)
+                return 200, {"ok": True, "result": {"message_id": next(self.message_ids)}}
+        if method == "getUpdates":
+            offset = body.get("offset", 0)
+            deadline = time.monotonic() + min(body.get("timeout", 0), 1)
+            while True:
+                with self.lock:
+                    batch = [u for u in self.updates if u["update_id"] >= offset][:body.get("limit", 100)]
+                if batch or time.monotonic() >= deadline:
+                    return 200, {"ok": True, "result": batch}
+                time.sleep(0.02)
+        return 200, {"ok": True, "result": True}
+
+
+def wait_until(predicate, timeout=5.0, interval=0.02):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return predicate()
+
+
+def received_count(app, text):
+    return app.get_db().execute("SELECT COUNT(*) FROM received_messages WHERE message = ?", (text,)).fetchone()[0]
+
+
+@pytest.fixture(scope="session")
+def bot_api():
+    api = FakeBotAPI()
+    yield api
+    api.server.shutdown()
+
+
+@pytest.fixture(scope="session")
+def app(bot_api, tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("app")
+    for name in os.listdir(ROOT):
+        if name == "linewalkers.json" or (name.startswith("OD_CH") and name.endswith(".csv")):
+            shutil.copy(os.path.join(ROOT, name), workdir)
+    with open(workdir / "settings.json", "w") as f:
+        json.dump(TEST_SETTINGS, f)
+
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    os.environ["TELEGRAM_API_BASE"] = bot_api.base_url
+    sys.path.insert(0, ROOT)
+    import main
+    yield main
+    os.chdir(previous_cwd)
+
+
+@pytest.fixture(scope="session")
+def client(app):
+    from fastapi.testclient import TestClient
+
+    with TestClient(app.app) as c:
+        yield c
+
+
+@pytest.fixture
+def telegram(bot_api, client):
+    bot_api.reset()
+    return bot_api
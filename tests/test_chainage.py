@@ -0,0 +1,49 @@
+"""ChainageIndex against a scan of every segment of every section."""
+import random
+
+
+def reference_locate(tables, ch):
+    # Every segment with distinct CH ends that contains the CH, in section
+    # order and then OD order; a breakpoint shared by two segments once
+    candidates = []
+    for section, table in tables.items():
+        ods, chs = table["OD"], table["CH"]
+        for i in range(len(ods) - 1):
+            ch1, ch2 = chs[i], chs[i + 1]
+            if ch1 != ch2 and min(ch1, ch2) <= ch <= max(ch1, ch2):
+                candidate = {"section": section, "od": round(ods[i] + ((ch - ch1) * (ods[i + 1] - ods[i])) / (ch2 - ch1))}
+                if candidate not in candidates:
+                    candidates.append(candidate)
+    return candidates
+
+
+def probe_chs(tables, count, seed):
+    bounds = sorted({ch for table in tables.values() for ch in table["CH"]})
+    rng = random.Random(seed)
+    midpoints = [(a + b) / 2 for a, b in zip(bounds, bounds[1:])]
+    return bounds + midpoints + [bounds[0] - 1, bounds[-1] + 1] + [rng.uniform(bounds[0], bounds[-1]) for _ in range(count)]
+
+
+def check(app, tables, chs):
+    index = app.ChainageIndex(tables)
+    expected = [reference_locate(tables, ch) for ch in chs]
+    assert [index.lookup(ch) for ch in chs] == expected
+    assert index.lookup_many(chs) == expected
+
+
+def test_section_tables_match_the_scan(app, client):
+    assert app.section_data
+    check(app, app.section_data, probe_chs(app.section_data, 5000, seed=4))
+
+
+def test_reversed_flat_and_overlapping_segments(app):
+    tables = {
+        "A to B": {"OD": [0, 1000, 2000, 3000], "CH": [300.0, 301.0, 301.0, 302.5]},  # a flat segment
+        "C to B": {"OD": [0, 500, 1500], "CH": [302.0, 301.5, 300.5]},  # CH falls along the OD
+        "C to D": {"OD": [0, 800], "CH": [302.0, 303.0]},  # shares 302.0 with "C to B"
+    }
+    check(app, tables, probe_chs(tables, 2000, seed=5))
+
+
+def test_empty_index(app):
+    assert app.ChainageIndex({}).lookup(300.0) == []
@@ -0,0 +1,54 @@
+import sqlite3
+
+import pytest
+
+from conftest import API_KEY, wait_until
+
+SECTION = "IPS to SV-08"
+
+
+@pytest.fixture
+def coalescing(client):
+    client.post("/coalescing", json={"enabled": True, "ch_distance": 0.5, "window_seconds": 1}, headers=API_KEY)
+    yield
+    client.post("/coalescing", json={"enabled": False}, headers=API_KEY)
+
+
+def sent_log_count(app, ch_values):
+    marks = ",".join("?" * len(ch_values))
+    return app.get_db().execute(f"SELECT COUNT(*) FROM sent_logs WHERE ch_num IN ({marks})", ch_values).fetchone()[0]
+
+
+def test_held_summary_survives_restart(app, client, telegram, coalescing):
+    chs = [311.1, 311.2, 311.3]
+    responses = [
+        client.post("/send_alert", json={"od": 1, "ch": ch, "section": SECTION, "line_walker": "t"}).json()
+        for ch in chs
+    ]
+    assert [r["status"] for r in responses] == ["queued", "coalesced", "coalesced"]
+    summary_id = responses[-1]["alert_id"]
+    assert app.get_outbox_row(summary_id)["status"] == "held"
+    # The two alarms that joined are logged on arrival, not when the summary goes out
+    assert sent_log_count(app, chs[1:]) == 2
+
+    app.alarm_coalescer.groups.clear()  # what a restart does to the open group
+
+    assert wait_until(lambda: app.get_outbox_row(summary_id)["status"] == "sent", timeout=10)
+    texts = [call[2]["text"] for call in telegram.calls_to("sendMessage")]
+    assert len(texts) == 2 and "संख्या: 3" in texts[1]
+    assert sent_log_count(app, chs) == 3
+
+
+def test_database_error_while_coalescing_is_reported(app, client, telegram, coalescing, monkeypatch):
+    first = client.post("/send_alert", json={"od": 1, "ch": 320.1, "section": SECTION, "line_walker": "t"})
+    assert first.json()["status"] == "queued"
+
+    def locked(conn, events, now):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(app, "insert_sent_logs", locked)
+    res = client.post("/send_alert", json={"od": 1, "ch": 320.2, "section": SECTION, "line_walker": "t"})
+
+    assert res.status_code == 200
+    assert res.json()["status"] == "error" and "database is locked" in res.json()["detail"]
+    assert wait_until(lambda: len(telegram.calls_to("sendMessage")) == 1)  # only the first alarm goes out
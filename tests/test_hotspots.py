@@ -0,0 +1,57 @@
+import threading
+from datetime import datetime
+
+from conftest import API_KEY
+
+
+def cells(app, section):
+    return app.get_db().execute(
+        "SELECT bin, count FROM hotspot_cells WHERE section = ? AND length(period) = 10 ORDER BY bin", (section,)
+    ).fetchall()
+
+
+def log_alarm(app, section, ch):
+    with app.db_transaction() as conn:
+        app.insert_sent_logs(conn, [{"Section": section, "CH": ch, "At": "2021-03-04 10:00:00"}], datetime.now())
+
+
+def test_bin_width_change_rebuilds_cells(app, client):
+    log_alarm(app, "hotspot-a", 5.5)
+    res = client.post("/hotspot_config", json={"bin_km": 2.0}, headers=API_KEY).json()
+    assert res["status"] == "success" and res["bin_km"] == 2.0
+    assert cells(app, "hotspot-a") == [(2, 1)]
+
+    client.post("/hotspot_config", json={"bin_km": 1.0}, headers=API_KEY)
+    assert cells(app, "hotspot-a") == [(5, 1)]
+
+
+def test_inserts_use_the_committed_bin_width(app, client, monkeypatch):
+    client.post("/hotspot_config", json={"bin_km": 1.0}, headers=API_KEY)
+    # A worker that has not picked up the new settings yet still bins by the stored width
+    monkeypatch.setitem(app.settings, "HOTSPOTS", {"bin_km": 10.0})
+    log_alarm(app, "hotspot-b", 5.5)
+    assert cells(app, "hotspot-b") == [(5, 1)]
+
+
+def test_alarms_are_logged_while_cells_are_rebuilt(app, client, monkeypatch):
+    client.post("/hotspot_config", json={"bin_km": 1.0}, headers=API_KEY)
+    log_alarm(app, "hotspot-c", 7.5)
+    archived_rows = app.archived_rows
+    logged_in_time = []
+
+    def log_meanwhile(*args):
+        # Another request logs an alarm halfway through the rebuild
+        worker = threading.Thread(target=log_alarm, args=(app, "hotspot-c", 9.5))
+        worker.start()
+        worker.join(timeout=3)
+        logged_in_time.append(not worker.is_alive())
+        return archived_rows(*args)
+
+    monkeypatch.setattr(app, "archived_rows", log_meanwhile)
+    res = client.post("/hotspot_config", json={"bin_km": 4.0}, headers=API_KEY).json()
+
+    assert logged_in_time == [True], "the alarm waited for the rebuild's write lock"
+    assert res["status"] == "success"
+    # Logged at the old width mid-rebuild, binned at the new one after the swap
+    assert cells(app, "hotspot-c") == [(1, 1), (2, 1)]
+    client.post("/hotspot_config", json={"bin_km": 1.0}, headers=API_KEY)
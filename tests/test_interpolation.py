@@ -0,0 +1,53 @@
+"""The NumPy OD -> CH engine against the row-by-row loop it replaced."""
+import random
+
+import pytest
+
+
+def reference_interpolate_ch(table, od):
+    # The original per-row loop: every segment containing the OD with a
+    # non-zero Diff contributes one CH
+    ods, chs, diffs = table["OD"], table["CH"], table["Diff"]
+    matches = []
+    for i in range(len(ods) - 1):
+        if ods[i] <= od <= ods[i + 1] and diffs[i] != 0:
+            matches.append(round(chs[i] + ((chs[i + 1] - chs[i]) * (od - ods[i]) / diffs[i]), 3))
+    return matches
+
+
+def section_table(points):
+    # Same Diff rule as read_section_table: the OD step from the previous row
+    od = [p[0] for p in points]
+    return {"OD": od, "CH": [p[1] for p in points], "Diff": [0.0] + [b - a for a, b in zip(od, od[1:])]}
+
+
+def probe_ods(table, count, seed):
+    ods = table["OD"]
+    rng = random.Random(seed)
+    midpoints = [(a + b) / 2 for a, b in zip(ods, ods[1:])]
+    outside = [ods[0] - 1, ods[-1] + 1]
+    return ods + midpoints + outside + [rng.uniform(ods[0], ods[-1]) for _ in range(count)]
+
+
+def test_shared_breakpoints_and_zero_diff_segments(app):
+    # Repeated ODs give zero-Diff segments; 10 and 30 are breakpoints shared
+    # by several segments, and CH runs backwards after 30
+    table = section_table([(0, 100), (10, 101), (10, 103), (20, 104), (30, 105), (30, 105), (40, 102), (55, 101.5)])
+    ods = probe_ods(table, 500, seed=1)
+
+    engine = app.SectionInterpolator(table)
+    assert engine.ch_for_ods(ods) == [reference_interpolate_ch(table, od) for od in ods]
+    assert [engine.ch_for_od(od) for od in ods] == [reference_interpolate_ch(table, od) for od in ods]
+
+
+def test_section_tables_match_the_old_loop(app, client):
+    assert app.section_data
+    for section, table in app.section_data.items():
+        ods = probe_ods(table, 2000, seed=section)
+        expected = [reference_interpolate_ch(table, od) for od in ods]
+        assert app.section_engines[section].ch_for_ods(ods) == expected, section
+
+
+@pytest.mark.parametrize("table", [section_table([(5, 1)]), section_table([])])
+def test_tables_without_segments(app, table):
+    assert app.SectionInterpolator(table).ch_for_ods([5.0, 6.0]) == [[], []]
@@ -0,0 +1,51 @@
+"""LineWalkerIndex against the linear scan it replaced."""
+import json
+import os
+import random
+
+from conftest import ROOT
+
+
+def reference_linewalker(entries, ch):
+    # The original scan: the first range in file order that contains the CH
+    for entry in entries:
+        if entry["start_ch"] <= ch <= entry["end_ch"]:
+            return entry["line_walker"]
+    return None
+
+
+def probe_chs(entries, count, seed):
+    bounds = sorted({e["start_ch"] for e in entries} | {e["end_ch"] for e in entries})
+    rng = random.Random(seed)
+    midpoints = [(a + b) / 2 for a, b in zip(bounds, bounds[1:])]
+    return bounds + midpoints + [bounds[0] - 1, bounds[-1] + 1] + [rng.uniform(bounds[0] - 2, bounds[-1] + 2) for _ in range(count)]
+
+
+def check(app, entries, chs):
+    index = app.LineWalkerIndex(entries)
+    expected = [reference_linewalker(entries, ch) for ch in chs]
+    assert [index.lookup(ch) for ch in chs] == expected
+    assert index.lookup_many(chs) == expected
+
+
+def test_linewalker_file_matches_the_linear_scan(app):
+    with open(os.path.join(ROOT, "linewalkers.json")) as f:
+        entries = json.load(f)
+    check(app, entries, probe_chs(entries, 5000, seed=2))
+
+
+def test_overlaps_gaps_and_shared_boundaries(app):
+    entries = [
+        {"start_ch": 10.0, "end_ch": 20.0, "line_walker": "a"},
+        {"start_ch": 20.0, "end_ch": 30.0, "line_walker": "b"},  # touches a at 20, which stays a's
+        {"start_ch": 15.0, "end_ch": 25.0, "line_walker": "c"},  # overlaps both, never first
+        {"start_ch": 40.0, "end_ch": 50.0, "line_walker": ""},  # after a gap, unassigned
+        {"start_ch": 45.0, "end_ch": 60.0, "line_walker": "d"},
+        {"start_ch": 70.0, "end_ch": 65.0, "line_walker": "e"},  # reversed, matches nothing
+        {"start_ch": 80.0, "end_ch": 80.0, "line_walker": "f"},  # a single point
+    ]
+    check(app, entries, probe_chs(entries, 2000, seed=3))
+
+
+def test_empty_index(app):
+    assert app.LineWalkerIndex([]).lookup(300.0) is None
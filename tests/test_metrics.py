@@ -0,0 +1,13 @@
+def sample(text, name):
+    return next(float(line.split()[-1]) for line in text.splitlines() if line.startswith(name + " "))
+
+
+def test_webhook_rows_committed_is_a_counter(client):
+    before = client.get("/metrics").text
+    assert "# TYPE pids_webhook_rows_committed_total counter" in before
+    assert "pids_webhook_rows_committed " not in before
+
+    client.post("/webhook", json={"update_id": 6001, "message": {"text": "counted", "from": {"first_name": "t"}}})
+
+    after = client.get("/metrics").text
+    assert sample(after, "pids_webhook_rows_committed_total") == sample(before, "pids_webhook_rows_committed_total") + 1
@@ -0,0 +1,68 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+from conftest import ROOT
+
+
+def run_worker(tmp_path, script, *args):
+    # A separate process, so the app the other tests share keeps its own database
+    env = {**os.environ, "PYTHONPATH": ROOT}
+    return subprocess.Popen([sys.executable, "-c", script, *args], cwd=tmp_path, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+
+def user_version(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def outbox_columns(path):
+    with sqlite3.connect(path) as conn:
+        return [row[1] for row in conn.execute("PRAGMA table_info(outbox)")]
+
+
+FAILING_MIGRATION = """
+import sqlite3, main
+
+def failing(conn):
+    raise sqlite3.OperationalError("disk I/O error")
+
+# 4: the ALTER TABLE goes through, then a step fails
+main.DB_MIGRATIONS[3] = main.DB_MIGRATIONS[3][:1] + [failing]
+try:
+    main.init_db()
+except sqlite3.OperationalError:
+    print("[Test] migration failed")
+"""
+
+
+def test_failed_migration_leaves_no_partial_schema(app, tmp_path):
+    path = tmp_path / "log.sqlite"
+    output = run_worker(tmp_path, FAILING_MIGRATION).communicate(timeout=120)[0]
+    assert "[Test] migration failed" in output, output
+    assert user_version(path) == 3
+    assert "alert_id" not in outbox_columns(path)
+
+    worker = run_worker(tmp_path, "import main; main.init_db()")
+    output = worker.communicate(timeout=120)[0]
+    # The next start applies it cleanly instead of "duplicate column name"
+    assert worker.returncode == 0, output
+    assert user_version(path) == len(app.DB_MIGRATIONS)
+    assert "alert_id" in outbox_columns(path)
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2  # incremental, so the VACUUM ran
+
+
+def test_workers_starting_together_migrate_once(app, tmp_path):
+    # Each worker imports main, then all of them call init_db() at the same moment
+    script = "import sys, time, main; time.sleep(max(0.0, float(sys.argv[1]) - time.time())); main.init_db()"
+    start_at = str(time.time() + 5)
+    workers = [run_worker(tmp_path, script, start_at) for _ in range(6)]
+    outputs = [worker.communicate(timeout=120)[0] for worker in workers]
+
+    assert [worker.returncode for worker in workers] == [0] * len(workers), outputs
+    assert user_version(tmp_path / "log.sqlite") == len(app.DB_MIGRATIONS)
+    applied = [line for output in outputs for line in output.splitlines() if line.startswith("[DB] Applied migration")]
+    assert sorted(applied) == [f"[DB] Applied migration {n}" for n in range(1, len(app.DB_MIGRATIONS) + 1)]
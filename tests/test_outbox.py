@@ -0,0 +1,61 @@
+import sqlite3
+
+from conftest import wait_until
+
+
+def test_retry_after_is_honoured(app, telegram):
+    telegram.responses.append((429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 2}}))
+    outbox_id = app.enqueue_alert(["2001"], "retry after", None)[0]
+
+    assert wait_until(lambda: app.get_outbox_row(outbox_id)["status"] == "sent", timeout=10)
+    first, second = telegram.calls_to("sendMessage")
+    assert second[0] - first[0] >= 2.0
+    assert app.get_outbox_row(outbox_id)["attempts"] == 2
+
+
+def test_paced_chat_does_not_busy_loop(app, telegram, monkeypatch):
+    dispatcher = app.outbox_dispatcher
+    passes = []
+    dispatch_due = dispatcher.dispatch_due
+
+    def counted():
+        passes.append(1)
+        return dispatch_due()
+
+    monkeypatch.setattr(dispatcher, "dispatch_due", counted)
+    # A private chat gets one message a second, so these go out over ~3 s
+    outbox_ids = [app.enqueue_alert(["2002"], f"paced {n}", None)[0] for n in range(4)]
+
+    assert wait_until(lambda: all(app.get_outbox_row(i)["status"] == "sent" for i in outbox_ids), timeout=10)
+    assert len(telegram.calls_to("sendMessage")) == 4
+    assert len(passes) < 20
+
+
+def test_fan_out_sends_each_destination_once(app, client, telegram):
+    res = client.post("/send_alert?wait=5", json={"od": 1, "ch": 300.5, "section": "IPS to SV-08", "line_walker": "t"})
+
+    body = res.json()
+    assert body["status"] == "success"
+    assert [d["chat_id"] for d in body["destinations"]] == ["1000"]
+    assert len(telegram.calls_to("sendMessage")) == 1
+
+
+def test_delivery_is_recorded_not_resent(app, telegram, monkeypatch):
+    insert_sent_logs = app.insert_sent_logs
+    failures = []
+
+    def locked_once(conn, events, now):
+        if not failures:
+            failures.append(1)
+            raise sqlite3.OperationalError("database is locked")
+        return insert_sent_logs(conn, events, now)
+
+    monkeypatch.setattr(app, "insert_sent_logs", locked_once)
+    telegram.responses.append((200, b"<html>not json</html>"))
+    outbox_id = app.enqueue_alert(["2003"], "recorded later", {"OD": 1, "CH": "312.7", "Section": "S"})[0]
+
+    assert wait_until(lambda: app.get_outbox_row(outbox_id)["status"] == "sent", timeout=10)
+    assert failures and len(telegram.calls_to("sendMessage")) == 1
+    row = app.get_outbox_row(outbox_id)
+    assert row["attempts"] == 1 and row["message_id"] is None
+    assert app.get_db().execute("SELECT COUNT(*) FROM sent_logs WHERE ch = '312.7'").fetchone()[0] == 1
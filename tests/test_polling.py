@@ -0,0 +1,38 @@
+import sqlite3
+
+import pytest
+
+from conftest import API_KEY, received_count, wait_until
+
+
+@pytest.fixture
+def polling(app, client, telegram, monkeypatch):
+    monkeypatch.setattr(app, "POLLING_ERROR_WAIT", 0.1)
+    monkeypatch.setattr(app, "WEBHOOK_RETRY_WAIT", 0.01)
+    client.post("/polling", json={"enabled": True, "timeout": 1}, headers=API_KEY)
+    assert wait_until(lambda: app.update_poller.active)
+    yield app.update_poller
+    client.post("/polling", json={"enabled": False}, headers=API_KEY)
+
+
+def test_offset_advances_only_after_commit(app, telegram, polling, monkeypatch):
+    offset = polling.offset
+    write = app.webhook_writer.write
+    failures = []
+
+    def failing(batch):
+        failures.append(1)
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(app.webhook_writer, "write", failing)
+    telegram.updates.append({"update_id": 7001, "message": {"text": "polled", "from": {"first_name": "t"}}})
+
+    assert wait_until(lambda: polling.stats["errors"] > 0)
+    assert polling.offset == offset
+    assert app.read_update_offset() == offset
+    assert received_count(app, "polled") == 0
+
+    monkeypatch.setattr(app.webhook_writer, "write", write)
+    assert wait_until(lambda: polling.offset == 7002)
+    assert app.read_update_offset() == 7002
+    assert received_count(app, "polled") == 1
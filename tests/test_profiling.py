@@ -0,0 +1,37 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import API_KEY
+
+INTERVAL_MS = 5.0
+
+
+@pytest.fixture
+def profiling(app, client):
+    client.post("/profiling", json={"enabled": True, "routes": "^/_test/", "interval_ms": INTERVAL_MS}, headers=API_KEY)
+    yield
+    client.post("/profiling", json={"enabled": False}, headers=API_KEY)
+
+
+@pytest.fixture(scope="module")
+def busy_route(app):
+    @app.app.get("/_test/busy")
+    def busy():
+        deadline = time.monotonic() + 0.3
+        while time.monotonic() < deadline:
+            pass
+        return {"ok": True}
+
+
+def test_concurrent_requests_to_a_route_are_not_double_counted(client, profiling, busy_route):
+    with ThreadPoolExecutor(2) as pool:
+        responses = list(pool.map(lambda _: client.get("/_test/busy"), range(2)))
+    assert all(r.status_code == 200 for r in responses)
+
+    profiles = [p for p in client.get("/profiles", headers=API_KEY).json() if p["path"] == "/_test/busy"][:2]
+    assert len(profiles) == 2
+    for profile in profiles:
+        # One sample per interval at most; crediting both requests' stacks would double it
+        assert 0 < profile["samples"] <= profile["duration_ms"] / INTERVAL_MS + 2
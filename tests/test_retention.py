@@ -0,0 +1,26 @@
+from datetime import datetime
+
+from conftest import API_KEY
+
+
+def test_retention_is_off_by_default(client):
+    assert client.get("/retention").json()["enabled"] is False
+
+
+def test_archiving_skips_malformed_rows_and_keeps_shift_counts(app, client):
+    with app.db_transaction() as conn:
+        conn.executemany(
+            "INSERT INTO received_messages (timestamp, linewalker, message, user) VALUES (?, ?, ?, ?)",
+            [("2020-01-05 10:00:00", "t", "old", "t"), ("05/01/2020 10:00", "t", "unreadable", "t")]
+        )
+        conn.execute("INSERT INTO sent_logs (date, time, section, linewalker, ts) VALUES ('2020-01-05', '10:00:00', 'S', 't', 'bad')")
+        app.insert_sent_logs(conn, [{"Section": "S", "LineWalker": "t", "At": "2020-01-10 12:00:00"}], datetime.now())
+
+    res = client.post("/retention/run", headers=API_KEY).json()
+
+    assert res["archived"]["received_messages"]["2020-01"] == 1
+    assert res["archived"]["sent_logs"]["2020-01"] == 1
+    assert res["skipped"] == {"received_messages": 1, "sent_logs": 1}
+    # The archived alarm's shift is not wiped by the startup rebuild
+    app.rebuild_shift_counts()
+    assert app.get_shift_counts("2020-01-10")["section"] == {"S": 1}
@@ -0,0 +1,58 @@
+import sqlite3
+
+from conftest import received_count
+
+
+def update(update_id, text):
+    return {"update_id": update_id, "message": {"text": text, "from": {"first_name": "t"}}}
+
+
+def test_duplicate_update_id_is_ignored(app, client):
+    first = client.post("/webhook", json=update(5001, "hi there"))
+    again = client.post("/webhook", json=update(5001, "hi there"))
+
+    assert first.json() == {"status": "received"}
+    assert again.json() == {"status": "duplicate"}
+    assert received_count(app, "hi there") == 1
+
+
+def test_failed_commit_is_retried(app, client, monkeypatch):
+    write = app.webhook_writer.write
+    failures = []
+
+    def flaky(batch):
+        if len(failures) < 2:
+            failures.append(1)
+            raise sqlite3.OperationalError("database is locked")
+        return write(batch)
+
+    monkeypatch.setattr(app.webhook_writer, "write", flaky)
+    res = client.post("/webhook", json=update(5002, "after a retry"))
+
+    assert res.json() == {"status": "received"}
+    assert len(failures) == 2
+    assert received_count(app, "after a retry") == 1
+
+
+def test_lost_update_is_not_marked_seen(app, client, monkeypatch):
+    monkeypatch.setattr(app, "WEBHOOK_RETRY_WAIT", 0.01)
+    monkeypatch.setattr(app.webhook_writer, "write", lambda batch: (_ for _ in ()).throw(sqlite3.OperationalError("disk I/O error")))
+    res = client.post("/webhook", json=update(5003, "redelivered"))
+    assert res.status_code == 500
+    monkeypatch.undo()
+
+    # Telegram delivers it again and this time it is stored, not dropped as a duplicate
+    res = client.post("/webhook", json=update(5003, "redelivered"))
+    assert res.json() == {"status": "received"}
+    assert received_count(app, "redelivered") == 1
+
+
+def test_update_processed_by_another_worker_is_ignored(app, client):
+    # Another worker already stored this update; this one has never seen it
+    with app.db_transaction() as conn:
+        conn.execute("INSERT INTO processed_updates (update_id, processed_at) VALUES (5004, 0)")
+
+    res = client.post("/webhook", json=update(5004, "stored elsewhere"))
+
+    assert res.json() == {"status": "duplicate"}
+    assert received_count(app, "stored elsewhere") == 0